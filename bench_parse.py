@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Checks and times the forum page parsers (see powertools.parsing) on saved
+pages.
+
+    ./bench_parse.py save pages/
+
+crawls the forum listings like a grab does, saving every page it sees.
+
+    ./bench_parse.py check pages/
+
+parses each saved page with every backend and complains about any page where
+they don't give exactly the same SiteShows (and next page). Pages whose index
+entry has "expected" SiteShows, like the hand-checked ones in parse_pages/
+(the default), are held to those instead of to the first backend.
+
+    ./bench_parse.py speed pages/ --repeat 5
+
+reports parse throughput for each backend.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from powertools.base import app
+from powertools.crawl import crawl
+from powertools.helpers import make_browser
+from powertools.parsing import BACKENDS
+from powertools.views import grab_shows
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_pages")
+
+
+def load_index(d):
+    with open(os.path.join(d, "index.json")) as f:
+        return json.load(f)
+
+
+def open_saved(d, page):
+    "A fresh browser showing a saved page, as if it had just been fetched."
+    resp = requests.Response()
+    with open(os.path.join(d, page["file"]), "rb") as f:
+        resp._content = f.read()
+    resp.status_code = 200
+    resp.url = page["url"]
+    resp.headers["Content-Type"] = "text/html; charset=UTF-8"
+    br = make_browser()
+    br._update_state(resp)
+    return br
+
+
+def parse_saved(d, page, backend):
+    br = open_saved(d, page)
+    if page["kind"] == "listing":
+        return grab_shows.LISTING_PARSERS[backend](br, page["url"], *page["args"])
+    else:
+        app.config["FORUM_PARSER"] = backend
+        return [grab_shows.parse_site_show(br, page["url"])], None
+
+
+def save(args):
+    os.makedirs(args.dir, exist_ok=True)
+    index = []
+    lock = threading.Lock()
+
+    def saving(parse, kind):
+        def save_and_parse(br, url, *parse_args):
+            with lock:
+                name = "{:04d}.html".format(len(index))
+                index.append(
+                    {"file": name, "url": url, "kind": kind, "args": parse_args}
+                )
+            with open(os.path.join(args.dir, name), "wb") as f:
+                f.write(br.response.content)
+
+            results, more = parse(br, url, *parse_args)
+            return results, [(u, save_and_parse, *rest) for u, _, *rest in more]
+
+        return save_and_parse
+
+    jobs = [
+        (url, saving(grab_shows._standalone_page, "standalone"))
+        for url in grab_shows.standalone_forums
+    ]
+    jobs.extend(
+        (url, saving(grab_shows._listing_page, "listing"), True)
+        for url in grab_shows.all_categories
+    )
+    n_shows = sum(1 for _ in crawl(jobs))
+
+    with open(os.path.join(args.dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=1)
+    print("Saved {} pages ({} shows) to {}".format(len(index), n_shows, args.dir))
+
+
+def expected(page):
+    "The SiteShows and next page that page's index entry says it has, if any."
+    if "expected" not in page:
+        return None
+    want = page["expected"]
+    return [grab_shows.SiteShow._make(s) for s in want["shows"]], want["next_page"]
+
+
+def check(args):
+    bad = 0
+    pages = load_index(args.dir)
+    for page in pages:
+        outs = {backend: parse_saved(args.dir, page, backend) for backend in BACKENDS}
+        reference = expected(page)
+        ref_name = "expected"
+        if reference is None:
+            reference = outs[BACKENDS[0]]
+            ref_name = BACKENDS[0]
+        for backend, out in outs.items():
+            if out != reference:
+                bad += 1
+                msg = "MISMATCH: {} ({}) with {}"
+                print(msg.format(page["file"], page["url"], backend))
+                ref_shows, out_shows = set(reference[0]), set(out[0])
+                for s in sorted(ref_shows - out_shows, key=repr):
+                    print("    only {}: {}".format(ref_name, s))
+                for s in sorted(out_shows - ref_shows, key=repr):
+                    print("    only {}: {}".format(backend, s))
+                if reference[1] != out[1]:
+                    print("    next page: {!r} vs {!r}".format(reference[1], out[1]))
+
+    n_shows = sum(len(parse_saved(args.dir, p, BACKENDS[0])[0]) for p in pages)
+    print("{} pages, {} shows: {}".format(
+        len(pages), n_shows, "{} mismatches".format(bad) if bad else "all match"))
+    return 1 if bad else 0
+
+
+def speed(args):
+    pages = load_index(args.dir)
+    size = sum(os.path.getsize(os.path.join(args.dir, p["file"])) for p in pages)
+    for backend in args.backends:
+        n_shows = 0
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for page in pages:
+                n_shows += len(parse_saved(args.dir, page, backend)[0])
+        elapsed = time.perf_counter() - start
+
+        n = len(pages) * args.repeat
+        print("{:>5}: {:7.1f} pages/s, {:6.1f} MB/s, {:8.0f} shows/s".format(
+            backend, n / elapsed, size * args.repeat / elapsed / 2 ** 20,
+            n_shows / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("save", help="crawl the forum listings to disk")
+    p.add_argument("dir")
+    p.set_defaults(func=save)
+
+    p = subparsers.add_parser("check", help="compare backends on saved pages")
+    p.add_argument("dir", nargs="?", default=PAGES_DIR)
+    p.set_defaults(func=check)
+
+    p = subparsers.add_parser("speed", help="time backends on saved pages")
+    p.add_argument("dir", nargs="?", default=PAGES_DIR)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--backends", nargs="+", default=list(BACKENDS),
+                   choices=BACKENDS)
+    p.set_defaults(func=speed)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
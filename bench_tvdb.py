@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the TVDB sync, run against a throwaway sqlite database.
+
+    ./bench_tvdb.py ingest --episodes 1000 10000
+
+pushes synthetic series through store_series and reports the time taken and
+the peak memory allocated while doing it.
+
+    ./bench_tvdb.py sync --series 500 --latency 0.05 --workers 8
+
+runs a full and then an incremental update_db against a local stand-in for
+the TVDB API (powertools.tvdb_standin), and reports series/sec, HTTP calls,
+and rows written.
+
+    ./bench_tvdb.py record 80379 73244 --out fixtures.json
+
+saves real TVDB data for those series to use with sync --fixtures.
+
+Redis is used for the TVDB token and such; --redis-url defaults to db 15 so
+as not to step on anything real.
+"""
+import argparse
+from collections import Counter
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def _redis_url():
+    for i, arg in enumerate(sys.argv):
+        if arg == '--redis-url' and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        if arg.startswith('--redis-url='):
+            return arg.split('=', 1)[1]
+    return 'redis://localhost/15'
+
+
+# has to happen before anything imports powertools.base
+_tmpdir = tempfile.mkdtemp(prefix='powertools-bench-')
+_settings = os.path.join(_tmpdir, 'settings.py')
+with open(_settings, 'w') as f:
+    # deploy.py has the real TVDB_API_KEY, for record
+    f.write("try:\n"
+            "    from powertools.config.deploy import *\n"
+            "except ImportError:\n"
+            "    from powertools.config.default import *\n"
+            "    TVDB_API_KEY = 'bench'\n")
+    f.write("DATABASE = {!r}\n".format(
+        'sqlite:///' + os.path.join(_tmpdir, 'bench.db')))
+    f.write("WEB_CACHE_BACKEND = 'sqlite'\n")
+    f.write("WEB_CACHE_PATH = {!r}\n".format(os.path.join(_tmpdir, 'cache')))
+    f.write("REDIS_URL = {!r}\n".format(_redis_url()))
+    f.write("TVDB_SYNC_CHUNK_SIZE = None\n")
+    f.write("LOG_HANDLERS = SIDE_LOG_HANDLERS = []\n")
+os.environ['POWERTOOLS_SETTINGS'] = _settings
+
+from powertools.base import app, db, redis  # noqa: E402
+from powertools.models import (  # noqa: E402
+    Show, ShowSearchTerm, ShowSearchTrigram, ShowTVDB)
+from powertools import tvdb  # noqa: E402
+from powertools.tvdb_standin import (  # noqa: E402
+    Fixtures, StandinServer, make_app)
+
+
+# Episode and ShowGenre map two fields onto seriesid, which create_tables
+# can't cope with, so spell out the (sqlite) schema by hand.
+SCHEMA = [
+    """CREATE TABLE meta (name VARCHAR(50) PRIMARY KEY, value TEXT)""",
+    """CREATE TABLE shows (
+        id INTEGER PRIMARY KEY, name TEXT, forum_id INTEGER,
+        has_forum INTEGER DEFAULT 1, url TEXT, forum_topics INTEGER,
+        forum_posts INTEGER, last_post DATETIME,
+        gone_forever INTEGER DEFAULT 0, needs_help INTEGER DEFAULT 0,
+        tvdb_not_matched_yet INTEGER DEFAULT 1,
+        is_a_tv_show INTEGER DEFAULT 1, hidden INTEGER DEFAULT 0,
+        deleted_at DATETIME)""",
+    """CREATE TABLE show_tvdb (
+        id INTEGER PRIMARY KEY, showid INTEGER, tvdb_id INTEGER UNIQUE,
+        name TEXT, aliases TEXT, first_aired DATE, network TEXT,
+        airs_day TEXT, airs_time TEXT, runtime TEXT, status TEXT,
+        overview TEXT, slug TEXT, imdb_id TEXT, zaptoit_id TEXT,
+        last_synced DATETIME)""",
+    """CREATE TABLE episodes (
+        id INTEGER PRIMARY KEY, epid INTEGER, seasonid INTEGER,
+        seriesid INTEGER, showid INTEGER, season_number TEXT,
+        episode_number TEXT, name TEXT, overview TEXT, first_aired DATE)""",
+    """CREATE INDEX episodes_seriesid ON episodes (seriesid, epid)""",
+    """CREATE TABLE show_genres (
+        showid INTEGER, seriesid INTEGER, genre VARCHAR(30),
+        PRIMARY KEY (genre, seriesid))""",
+    """CREATE TABLE turfs (
+        showid INTEGER, modid INTEGER, state VARCHAR(1), comments TEXT,
+        PRIMARY KEY (modid, showid))""",
+]
+
+
+def make_schema():
+    for stmt in SCHEMA:
+        db.execute_sql(stmt)
+    db.create_tables([ShowSearchTerm, ShowSearchTrigram])
+
+
+def add_series(tvdb_id, name=None):
+    name = name or 'Series {}'.format(tvdb_id)
+    show = Show.create(
+        name=name, forum_id=tvdb_id, url='https://example.com/{}'.format(tvdb_id),
+        forum_topics=0, forum_posts=0, last_post=None)
+    return ShowTVDB.create(
+        show=show, tvdb_id=tvdb_id, name=name, aliases='[]', first_aired=None,
+        network='', airs_day='', airs_time='', runtime='', status='Continuing',
+        overview='', slug='', imdb_id='', zaptoit_id='',
+        last_synced='1970-01-01')
+
+
+def synthetic_show_info(tvdb_id):
+    return {
+        'seriesName': 'Series {}'.format(tvdb_id), 'aliases': [],
+        'firstAired': '2001-01-01', 'network': 'Bench', 'airsDayOfWeek': '',
+        'airsTime': '', 'runtime': '60', 'status': 'Continuing',
+        'imdbId': '', 'zap2itId': '', 'overview': 'Some show.', 'slug': '',
+        'genre': ['Soap'],
+    }
+
+
+def synthetic_episode(tvdb_id, i, rev=0):
+    season, number = divmod(i, 250)
+    return {
+        'id': tvdb_id * 100000 + i,
+        'airedSeasonID': tvdb_id * 100 + season,
+        'airedSeason': season + 1,
+        'airedEpisodeNumber': number + 1,
+        'episodeName': 'Episode {} (rev {})'.format(i, rev),
+        'overview': 'Things happen. ' * 20,
+        'firstAired': '2001-01-01',
+    }
+
+
+def synthetic_episodes(tvdb_id, n, rev=0):
+    return (synthetic_episode(tvdb_id, i, rev) for i in range(n))
+
+
+def bench_ingest(args):
+    for i, n in enumerate(args.episodes, 1):
+        add_series(i)
+        for label, rev in [('insert', 0), ('no-op', 0), ('update', 1)]:
+            tracemalloc.start()
+            start = time.time()
+            stats = tvdb.store_series(
+                i, synthetic_show_info(i), synthetic_episodes(i, n, rev))
+            elapsed = time.time() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print("{:>7,} episodes, {:>6}: {:6.2f}s, peak {:7.1f} KiB; {}".format(
+                n, label, elapsed, peak / 1024,
+                ', '.join('{} {}'.format(v, k) for k, v in sorted(stats.items()))
+                or 'no rows touched'))
+
+
+def _fmt_counts(counts):
+    return ', '.join('{} {}'.format(v, k) for k, v in sorted(counts.items()))
+
+
+def run_phase(name, standin, fn):
+    standin.calls.clear()
+    stats = Counter()
+    start = time.time()
+    fn(stats)
+    elapsed = time.time() - start
+
+    n_series = standin.calls['series']
+    print("{}: {} series in {:.2f}s ({:.1f} series/sec)".format(
+        name, n_series, elapsed, n_series / elapsed if elapsed else 0))
+    print("    HTTP: {} calls ({})".format(
+        sum(standin.calls.values()), _fmt_counts(standin.calls)))
+    print("    rows: {} ({})".format(
+        sum(stats.values()), _fmt_counts(stats) or 'none'))
+
+
+def bench_sync(args):
+    if args.fixtures:
+        fixtures = Fixtures.load(args.fixtures)
+    else:
+        fixtures = Fixtures.synthetic(args.series, seed=args.seed)
+    for tvdb_id in fixtures.series:
+        add_series(tvdb_id)
+    print("{} series, {} episodes".format(
+        len(fixtures.series),
+        sum(len(s['episodes']) for s in fixtures.series.values())))
+
+    # start from a clean slate
+    for key in [tvdb.TOKEN_KEY, tvdb.CHANGES_SINCE_KEY,
+                *redis.keys(tvdb.CHANGES_KEY.format('*'))]:
+        redis.delete(key)
+
+    standin = make_app(fixtures, latency=args.latency, jitter=args.jitter,
+                       error_rate=args.error_rate, seed=args.seed)
+    with StandinServer(standin) as server:
+        app.config['TVDB_API_BASE'] = server.url
+        app.config['TVDB_PAGE_WORKERS'] = args.page_workers
+
+        run_phase('full', standin, lambda stats: tvdb.update_db(
+            force=True, workers=args.workers, stats=stats))
+
+        rng = random.Random(args.seed)
+        ids = sorted(fixtures.series)
+        fixtures.touch(rng.sample(ids, int(len(ids) * args.changed)))
+        run_phase('incremental', standin, lambda stats: tvdb.update_db(
+            workers=args.workers, stats=stats))
+
+
+def record(args):
+    series = {}
+    for tvdb_id in args.ids:
+        series[tvdb_id] = {
+            'info': tvdb.get_show_info(tvdb_id),
+            'episodes': list(tvdb.iter_episodes(tvdb_id)),
+            'last_updated': int(time.time()),
+        }
+        print("{}: {} episodes".format(
+            series[tvdb_id]['info']['seriesName'],
+            len(series[tvdb_id]['episodes'])))
+    Fixtures(series).dump(args.out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost/15')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('ingest', help="store_series on synthetic data")
+    p.add_argument('--episodes', type=int, nargs='+', default=[1000, 10000])
+    p.set_defaults(func=bench_ingest)
+
+    p = subparsers.add_parser('sync', help="update_db against a stand-in TVDB")
+    p.add_argument('--fixtures', help="JSON file from the record command")
+    p.add_argument('--series', type=int, default=200,
+                   help="number of synthetic series, without --fixtures")
+    p.add_argument('--changed', type=float, default=0.1,
+                   help="fraction of series to change before the "
+                        "incremental sync")
+    p.add_argument('--latency', type=float, default=0.02)
+    p.add_argument('--jitter', type=float, default=0.01)
+    p.add_argument('--error-rate', type=float, default=0)
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--page-workers', type=int, default=4)
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=bench_sync)
+
+    p = subparsers.add_parser('record', help="save real TVDB data as fixtures")
+    p.add_argument('ids', type=int, nargs='+')
+    p.add_argument('--out', required=True)
+    p.set_defaults(func=record)
+
+    args = parser.parse_args()
+    with app.app_context():
+        db.connect(reuse_if_open=True)
+        make_schema()
+        args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,15 @@
 import argparse
 import shutil
 import sys
-import time
 
 from powertools.views.grab_shows import start_or_join_merge_shows_list, \
-                                        get_status_info
+                                        progress_events
 
 try:
     parser = argparse.ArgumentParser()
-    parser.add_argument('--refresh', type=int, default=2)
+    parser.add_argument('--refresh', type=int, default=15,
+                        help="check on the task if no updates come for this "
+                             "many seconds")
     parser.add_argument('--quiet', '-q', action='store_true', default=False)
     parser.add_argument('--detach', '-d', action='store_true', default=False)
     args = parser.parse_args()
@@ -20,14 +21,11 @@ try:
     elif args.quiet:
         task.get()
     else:
-        while True:
-            info = get_status_info(task)
+        for info in progress_events(task.id, timeout=args.refresh):
             cols, _ = shutil.get_terminal_size()
-
-            print("\r{:{width}}".format(str(info)[:cols], width=cols), end='')
-            if task.ready():
-                break
-            time.sleep(args.refresh)
+            print("\r{:{width}}".format(info['status'][:cols], width=cols),
+                  end='')
+        print()
 
     task.forget()
 except KeyboardInterrupt:
@@ -21,6 +21,7 @@ from .helpers import (
     SITE_BASE,
 )
 from .models import Mod
+from .overview import touch_overview
 
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
@@ -205,6 +206,7 @@ def refresh_username():
     mod.set_url(new_url)
     mod.name = name
     mod.save()
+    touch_overview()
     flash(f"Okay, changed your name to {name}!")
 
     return redirect(target)
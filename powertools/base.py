@@ -103,4 +103,4 @@ bcrypt = Bcrypt(app)
 db = make_peewee_db(app)
 celery = make_celery(app, db)
 sentry = make_sentry(app)
-redis = Redis()
+redis = Redis.from_url(app.config.get('REDIS_URL', 'redis://localhost'))
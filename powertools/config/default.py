@@ -9,6 +9,74 @@ ADMINS = ['danica.j.sutherland@gmail.com']
 
 BCRYPT_LOG_ROUNDS = 12
 
+# how many series to fetch from TVDB in parallel when syncing
+TVDB_SYNC_WORKERS = 1
+# how many episode pages of a single series to fetch in parallel
+TVDB_PAGE_WORKERS = 4
+# how many episodes to write per batch (and per transaction) when syncing
+TVDB_INSERT_BATCH_SIZE = 100
+# override powertools.tvdb.REFRESH_DAYS to change how often series get
+# re-synced without TVDB reporting any changes
+# TVDB_REFRESH_DAYS = {'airing': 1, 'turfed': 3, 'continuing': 7,
+#                      'ended_turfed': 14, 'ended': 30}
+# where cached TVDB responses go: 'file' (unbounded FileCache under
+# WEB_CACHE_PATH, default /dev/shm/<uid>/web_cache), 'sqlite' (a file in
+# WEB_CACHE_PATH), or 'redis' (shared between hosts); the latter two are
+# capped at WEB_CACHE_MAX_BYTES, and entries expire after WEB_CACHE_TTL seconds
+WEB_CACHE_BACKEND = 'file'
+WEB_CACHE_PATH = None
+WEB_CACHE_MAX_BYTES = 256 * 2**20
+WEB_CACHE_TTL = 7 * 24 * 60 * 60
+# if set, update_db fans out over celery workers in chunks of this many series
+TVDB_SYNC_CHUNK_SIZE = None
+
+# forum requests time out after FORUM_HTTP_TIMEOUT seconds, and ones that
+# time out or get a 429 / 502 / 503 / 504 are retried up to FORUM_HTTP_RETRIES
+# times, waiting FORUM_HTTP_BACKOFF * 2 ** n seconds in between; each process
+# keeps up to FORUM_HTTP_POOL_SIZE connections to the forums open
+FORUM_HTTP_TIMEOUT = 30
+FORUM_HTTP_RETRIES = 4
+FORUM_HTTP_BACKOFF = 1
+FORUM_HTTP_POOL_SIZE = 10
+# the forum login is shared by every process through redis for up to
+# FORUM_SESSION_TTL seconds, and only re-checked against the site every
+# FORUM_SESSION_CHECK_INTERVAL seconds; each process keeps up to
+# FORUM_BROWSER_POOL_SIZE idle forum sessions around between requests / tasks
+FORUM_SESSION_TTL = 24 * 60 * 60
+FORUM_SESSION_CHECK_INTERVAL = 15 * 60
+FORUM_BROWSER_POOL_SIZE = 8
+# how many logged-in forum sessions to crawl with at once when grabbing shows,
+# and the most requests to have in flight to any one host
+FORUM_CRAWL_WORKERS = 4
+FORUM_CRAWL_PER_HOST = 4
+# how many new/changed shows to write per transaction when merging a crawl
+FORUM_MERGE_BATCH_SIZE = 500
+# remember each listing page between crawls (for FORUM_PAGE_STORE_TTL seconds),
+# and don't re-parse ones that come back 304 or with the same content
+FORUM_CRAWL_INCREMENTAL = True
+FORUM_PAGE_STORE_TTL = 7 * 24 * 60 * 60
+# save how far a grab has got every FORUM_CRAWL_CHECKPOINT_INTERVAL seconds,
+# so that if it dies the next one carries on from there, as long as it starts
+# within FORUM_CRAWL_CHECKPOINT_TTL seconds
+FORUM_CRAWL_RESUME = True
+FORUM_CRAWL_CHECKPOINT_INTERVAL = 10
+FORUM_CRAWL_CHECKPOINT_TTL = 6 * 60 * 60
+# how long to remember what a forum / thread page looked like when checking
+# whether a show converted between the two
+FORUM_PROBE_TTL = 24 * 60 * 60
+# send grab progress to the browser / CLI once per this many shows or seconds
+GRAB_PROGRESS_EVERY = 250
+GRAB_PROGRESS_INTERVAL = 2
+# how long an unused version of the cached /turfs/ overview stays in redis
+TURFS_OVERVIEW_TTL = 24 * 60 * 60
+# rows per request when the /turfs/ page loads its table, and the most allowed
+TURFS_PAGE_SIZE = 100
+TURFS_MAX_PAGE_SIZE = 500
+# how long an unused version of the turfs CSV dump stays in redis
+TURFS_CSV_TTL = 24 * 60 * 60
+# how to parse scraped forum pages: 'lxml' (fast) or 'soup' (BeautifulSoup)
+FORUM_PARSER = 'lxml'
+
 LOG_HANDLERS = []
 SIDE_LOG_HANDLERS = []
 
@@ -25,6 +93,9 @@ side_lh.setFormatter(LOG_FORMATTER)
 SIDE_LOG_HANDLERS = [side_lh]
 
 
+REDIS_URL = 'redis://localhost'
+
+
 class CeleryConfig(object):
     pass
 
@@ -0,0 +1,391 @@
+"""
+A small concurrent crawler for the forums: a thread pool sharing a pool of
+logged-in browsers, with a cap on how many requests are in flight to any one
+host at a time. With a PageStore, pages that haven't changed since the last
+crawl aren't parsed again; with a CrawlCheckpoint, a crawl that dies part of
+the way through can pick up where it left off.
+"""
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import hashlib
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .base import app, redis
+from .helpers import ensure_logged_in, make_browser
+
+
+class SessionPool:
+    "Up to `size` browsers, each logged in the first time it's handed out."
+
+    def __init__(self, size, login=True):
+        self.size = size
+        self.login = login
+        self._idle = queue.LifoQueue()
+        self._made = 0
+        self._lock = threading.Lock()
+
+    def _make(self):
+        br = make_browser()
+        if self.login:
+            ensure_logged_in(br)
+        return br
+
+    @contextmanager
+    def session(self):
+        try:
+            br = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_make = self._made < self.size
+                if can_make:
+                    self._made += 1
+            if can_make:
+                try:
+                    br = self._make()
+                except BaseException:
+                    with self._lock:
+                        self._made -= 1
+                    raise
+            else:
+                br = self._idle.get()
+
+        try:
+            yield br
+        finally:
+            self._idle.put(br)
+
+
+class HostLimiter:
+    "Lets at most per_host callers at a time into `with limiter(url):`."
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._sems = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.per_host)
+        with sem:
+            yield
+
+
+def encode_job(job):
+    "A JSON-able version of a crawl job, with the parse function's name."
+    url, parse, *args = job
+    return [url, parse.__name__, *args]
+
+
+def decode_job(data, parsers):
+    url, name, *args = data
+    return (url, parsers[name], *args)
+
+
+class PageStore:
+    """
+    Remembers, per URL, the ETag / Last-Modified headers and a hash of the
+    part of the page we care about from the last crawl, along with what parse
+    made of it. `region(browser)` gives that part, as a list of strings; if
+    it's not given or finds nothing, the whole body is hashed. Results are
+    stored as JSON, and turned back into objects with `decode`.
+
+    Counts of pages fetched, not modified (304), and fetched but unchanged go
+    in .stats, along with bytes downloaded and bytes saved by 304s.
+    """
+
+    def __init__(
+        self, conn=None, decode=None, region=None, prefix="crawl_page", ttl=None
+    ):
+        if ttl is None:
+            ttl = app.config.get("FORUM_PAGE_STORE_TTL", 7 * 24 * 60 * 60)
+        self.conn = redis if conn is None else conn
+        self.decode = decode
+        self.region = region
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, **kwargs):
+        with self._lock:
+            self.stats.update(kwargs)
+
+    def _key(self, url):
+        return "{}:{}".format(self.prefix, url)
+
+    def get(self, url):
+        entry = self.conn.get(self._key(url))
+        return None if entry is None else json.loads(entry)
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def digest(self, br):
+        parts = self.region(br) if self.region else []
+        if parts:
+            content = "".join(parts).encode()
+        else:
+            content = br.response.content
+        return hashlib.sha1(content).hexdigest()
+
+    def save(self, url, br, digest, results, more):
+        entry = {
+            "etag": br.response.headers.get("ETag"),
+            "last_modified": br.response.headers.get("Last-Modified"),
+            "hash": digest,
+            "size": len(br.response.content),
+            "results": list(results),
+            "more": [encode_job(job) for job in more],
+        }
+        self.conn.setex(self._key(url), self.ttl, json.dumps(entry))
+
+    def restore(self, entry, parsers):
+        "The stored (results, more), or None if we can't rebuild them."
+        try:
+            more = [decode_job(job, parsers) for job in entry["more"]]
+        except KeyError:
+            return None
+        decode = self.decode or (lambda x: x)
+        return [decode(r) for r in entry["results"]], more
+
+
+class CrawlCheckpoint:
+    """
+    Keeps track in redis of how far a crawl has got: the jobs still to do,
+    the pages already done, and two sets of JSON-able tuples from the caller:
+    things it's seen so far (added with .see()), and things it's put off
+    dealing with until the end (.defer()). If a crawl with the same name is
+    started again before the checkpoint expires (after `ttl` seconds, default
+    FORUM_CRAWL_CHECKPOINT_TTL, from the last save), it only runs the jobs
+    that were left.
+
+    Progress is saved at most once every `interval` seconds, default
+    FORUM_CRAWL_CHECKPOINT_INTERVAL; before_save is called first, so that
+    the caller can write out whatever it's done with the results so far.
+    A page only counts as done once the caller has consumed all its results.
+    """
+
+    def __init__(self, name, conn=None, ttl=None, interval=None, before_save=None):
+        if ttl is None:
+            ttl = app.config.get("FORUM_CRAWL_CHECKPOINT_TTL", 6 * 60 * 60)
+        if interval is None:
+            interval = app.config.get("FORUM_CRAWL_CHECKPOINT_INTERVAL", 10)
+        self.conn = redis if conn is None else conn
+        self.name = name
+        self.ttl = ttl
+        self.interval = interval
+        self.before_save = before_save
+
+        self.started = None
+        self.resumed = False
+        self.seen = set()
+        self.deferred = set()
+        self._done = set()
+        self._new = {"seen": set(), "deferred": set()}
+        self._new_done = []
+        self._last_save = time.time()
+
+    def _key(self, part):
+        return "{}:{}".format(self.name, part)
+
+    @property
+    def _keys(self):
+        return [self._key(p) for p in ["meta", "pending", "done", "seen", "deferred"]]
+
+    def exists(self):
+        return bool(self.conn.exists(self._key("meta")))
+
+    def start(self, jobs, parsers):
+        "The jobs to run: the ones left over from last time, if any, or jobs."
+        meta = self.conn.hgetall(self._key("meta"))
+        if meta:
+            self.resumed = True
+            self.started = float(meta[b"started"])
+            self._done = {u.decode() for u in self.conn.smembers(self._key("done"))}
+            self.seen = self._load_set("seen")
+            self.deferred = self._load_set("deferred")
+            pending = self.conn.hvals(self._key("pending"))
+            return [decode_job(json.loads(job), parsers) for job in pending]
+
+        self.started = time.time()
+        with self.conn.pipeline() as pipe:
+            pipe.hset(self._key("meta"), "started", self.started)
+            for job in jobs:
+                pipe.hset(self._key("pending"), job[0], json.dumps(encode_job(job)))
+            for key in self._keys:
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+        self._last_save = time.time()
+        return list(jobs)
+
+    def _load_set(self, name):
+        return {tuple(json.loads(s)) for s in self.conn.smembers(self._key(name))}
+
+    def _add(self, name, items, item):
+        item = tuple(item)
+        if item not in items:
+            items.add(item)
+            self._new[name].add(item)
+
+    def see(self, item):
+        self._add("seen", self.seen, item)
+
+    def defer(self, item):
+        self._add("deferred", self.deferred, item)
+
+    def done(self, job, more):
+        "Records that job is finished, and gave the jobs in more."
+        self._new_done.append((job, more))
+        if time.time() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        if self.before_save is not None:
+            self.before_save()
+
+        with self.conn.pipeline() as pipe:
+            for job, more in self._new_done:
+                self._done.add(job[0])
+                pipe.hdel(self._key("pending"), job[0])
+                pipe.sadd(self._key("done"), job[0])
+            for job, more in self._new_done:
+                for new in more:
+                    if new[0] not in self._done:
+                        data = json.dumps(encode_job(new))
+                        pipe.hset(self._key("pending"), new[0], data)
+            for name, items in self._new.items():
+                if items:
+                    members = [json.dumps(list(s)) for s in items]
+                    pipe.sadd(self._key(name), *members)
+            for key in self._keys:
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+
+        self._new_done = []
+        self._new = {name: set() for name in self._new}
+        self._last_save = time.time()
+
+    def clear(self):
+        self.conn.delete(*self._keys)
+
+
+def crawl(
+    jobs, workers=None, per_host=None, sessions=None, store=None, checkpoint=None
+):
+    """
+    Runs each job, a tuple (url, parse, *args), by opening url in a pooled
+    browser and then calling parse(browser, url, *args), which returns a list
+    of results and a list of further jobs. Yields results as they come in, in
+    no particular order.
+
+    workers defaults to FORUM_CRAWL_WORKERS, and per_host (the most requests
+    to send any one host at once) to FORUM_CRAWL_PER_HOST. With a PageStore,
+    requests are conditional, and pages that come back 304 or whose content
+    hashes the same as last time give their stored results instead of being
+    parsed again. Results from parse need to be JSON-able for that.
+
+    With a CrawlCheckpoint, only the jobs left from an unfinished crawl are
+    run, if there was one, and progress is saved as pages are done. Either
+    way, the crawl has only really finished if this runs to the end.
+    """
+    if workers is None:
+        workers = app.config.get("FORUM_CRAWL_WORKERS", 4)
+    if per_host is None:
+        per_host = app.config.get("FORUM_CRAWL_PER_HOST", workers)
+    if sessions is None:
+        sessions = SessionPool(workers)
+    limit = HostLimiter(per_host)
+    jobs = list(jobs)
+    parsers = {parse.__name__: parse for _, parse, *_ in jobs}
+    if checkpoint is not None:
+        jobs = checkpoint.start(jobs, parsers)
+
+    def run(job):
+        url, parse, *args = job
+        with sessions.session() as br:
+            if store is None:
+                with limit(url):
+                    br.open(url)
+                return parse(br, url, *args)
+            return _run_stored(br, url, parse, args)
+
+    def _run_stored(br, url, parse, args):
+        parsers.setdefault(parse.__name__, parse)
+        entry = store.get(url)
+
+        if entry is not None:
+            with limit(url):
+                br.open(url, headers=store.conditional_headers(entry))
+            if br.response.status_code == 304:
+                restored = store.restore(entry, parsers)
+                if restored is not None:
+                    store.count(not_modified=1, bytes_saved=entry["size"])
+                    return restored
+                entry = None
+
+        if entry is None or br.response.status_code == 304:
+            with limit(url):
+                br.open(url)
+        store.count(fetched=1, bytes=len(br.response.content))
+
+        if not br.response.ok:
+            return parse(br, url, *args)
+
+        digest = store.digest(br)
+        if entry is not None and entry["hash"] == digest:
+            restored = store.restore(entry, parsers)
+            if restored is not None:
+                store.count(unchanged=1)
+                return restored
+
+        results, more = parse(br, url, *args)
+        store.save(url, br, digest, results, more)
+        return results, more
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(run, job): job for job in jobs}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    job = pending.pop(fut)
+                    results, more = fut.result()
+                    pending.update((pool.submit(run, new), new) for new in more)
+                    yield from results
+                    if checkpoint is not None:
+                        checkpoint.done(job, more)
+        finally:
+            for fut in pending:
+                fut.cancel()
+        if checkpoint is not None:
+            checkpoint.save()
+
+
+def describe_stats(stats):
+    "A one-line summary of a PageStore's stats."
+    msg = (
+        "{} pages fetched ({} unchanged), {} not modified; "
+        "{:.1f} MB downloaded, {:.1f} MB saved"
+    )
+    return msg.format(
+        stats.get("fetched", 0),
+        stats.get("unchanged", 0),
+        stats.get("not_modified", 0),
+        stats.get("bytes", 0) / 2 ** 20,
+        stats.get("bytes_saved", 0) / 2 ** 20,
+    )
@@ -1,18 +1,29 @@
+from collections import Counter
 import datetime
 from functools import wraps
+import hashlib
+import json
+import queue
 import re
 import socket
 import tempfile
+import threading
+import time
 from unittest import mock
 from urllib.parse import urlsplit, urlunsplit, quote_plus
 
 from flask import Response, escape, g, request, url_for
 from humanize import time as humanize_time
+import redis_lock
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
 from robobrowser import RoboBrowser
 from robobrowser.exceptions import RoboError
 from unidecode import unidecode
+from urllib3.util.retry import Retry
 
-from .base import app
+from .base import app, redis
 
 
 no_arg_sentinel = object()
@@ -62,6 +73,8 @@ def tvdb_url(search_info):
 
 @app.template_filter()
 def any_tvdbs(tvdb_ids):
+    if isinstance(tvdb_ids, list):  # e.g. from viewmodels.ShowRow
+        return bool(tvdb_ids)
     try:
         next(iter(tvdb_ids.select()))
     except StopIteration:
@@ -211,29 +224,211 @@ SITE_BASE = "https://forums.primetimer.com"
 SITE_BASE_split = urlsplit(SITE_BASE)
 
 
-def make_browser():
-    return RoboBrowser(history=True, timeout=30)
+_temp_codes = {502, 503, 504}
+
+
+class HTTPStats:
+    "Counts of forum requests by status (or error), retries, and time taken."
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def record(self, elapsed, status=None, error=None, retries=0):
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["seconds"] += elapsed
+            self.counts["retries"] += retries
+            if error is not None:
+                self.counts["error " + error] += 1
+            else:
+                self.counts["status {}".format(status)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.counts)
+
+
+def describe_http_stats(counts):
+    "A one-line summary of (some difference of) HTTPStats counts."
+    n = counts.get("requests", 0)
+    if not n:
+        return "no requests"
+    kinds = sorted(k for k in counts if k.startswith(("status ", "error ")))
+    return "{} requests ({}), {} retries, {:.2f}s average".format(
+        n,
+        ", ".join("{} {}".format(counts[k], k) for k in kinds),
+        counts.get("retries", 0),
+        counts.get("seconds", 0) / n,
+    )
+
+
+http_stats = HTTPStats()
+
+
+class ForumAdapter(HTTPAdapter):
+    """
+    The connection pool every forum browser in a process shares: keeps
+    connections alive between browsers, retries with exponential backoff on
+    timeouts, connection errors and 429 / 502 / 503 / 504 (for GETs and other
+    idempotent requests only), and counts everything in http_stats.
+    """
+
+    def __init__(self, pool_size=None, retries=None, backoff=None):
+        if pool_size is None:
+            pool_size = app.config.get("FORUM_HTTP_POOL_SIZE", 10)
+        if retries is None:
+            retries = app.config.get("FORUM_HTTP_RETRIES", 4)
+        if backoff is None:
+            backoff = app.config.get("FORUM_HTTP_BACKOFF", 1)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=[429] + sorted(_temp_codes),
+            raise_on_status=False,
+        )
+        super().__init__(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = super().send(request, **kwargs)
+        except requests.RequestException as e:
+            http_stats.record(time.perf_counter() - start, error=type(e).__name__)
+            raise
+        retries = getattr(resp.raw, "retries", None)
+        http_stats.record(
+            time.perf_counter() - start,
+            status=resp.status_code,
+            retries=len(retries.history) if retries is not None else 0,
+        )
+        return resp
+
+
+_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def forum_adapter():
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = ForumAdapter()
+    return _adapter
+
+
+def make_browser(session=None):
+    """
+    A browser on session, by default a fresh one (with its own cookies) on the
+    shared forum connections.
+    """
+    if session is None:
+        session = requests.Session()
+        for prefix in ["http://", "https://"]:
+            session.mount(prefix, forum_adapter())
+    return RoboBrowser(
+        session=session,
+        history=True,
+        timeout=app.config.get("FORUM_HTTP_TIMEOUT", 30),
+        parser="lxml",
+    )
+
+
+# (session, login digest) pairs from browsers no app context is using right
+# now, so the next one can pick up the cookies and connections; the browser
+# itself is made new each time, so it starts without any history
+_idle_sessions = queue.LifoQueue(maxsize=app.config.get("FORUM_BROWSER_POOL_SIZE", 8))
 
 
 def get_browser():
+    "A browser for this app context; its session goes back in a shared pool."
     if not hasattr(g, "browser"):
-        g.browser = make_browser()
+        try:
+            session, digest = _idle_sessions.get_nowait()
+        except queue.Empty:
+            g.browser = make_browser()
+        else:
+            g.browser = make_browser(session)
+            if digest is not None:
+                g.browser._forum_session = digest
     return g.browser
 
 
-_temp_codes = {502, 503, 504}
+@app.teardown_appcontext
+def _release_browser(exc):
+    br = g.pop("browser", None)
+    if br is not None:
+        try:
+            _idle_sessions.put_nowait(
+                (br.session, getattr(br, "_forum_session", None))
+            )
+        except queue.Full:
+            pass
+
+
+# The forum login is shared between every browser in every process: the
+# session cookies live in redis, and once someone has checked that they still
+# work, nobody checks again for FORUM_SESSION_CHECK_INTERVAL seconds.
+SESSION_KEY = "forum_session"
+SESSION_CHECKED_KEY = "forum_session_checked"
+
 
+def _cookie_data(cookie):
+    return {
+        "name": cookie.name,
+        "value": cookie.value,
+        "domain": cookie.domain,
+        "path": cookie.path,
+        "expires": cookie.expires,
+        "secure": cookie.secure,
+    }
 
-def login(browser, retry=True):
+
+def _save_session(browser):
+    "Shares browser's (logged-in) cookies, and notes that they've been checked."
+    cookies = sorted(
+        (_cookie_data(c) for c in browser.session.cookies),
+        key=lambda c: (c["domain"], c["path"], c["name"]),
+    )
+    data = json.dumps(cookies)
+    digest = hashlib.sha1(data.encode()).hexdigest()
+    redis.setex(SESSION_KEY, app.config.get("FORUM_SESSION_TTL", 24 * 60 * 60), data)
+    redis.setex(
+        SESSION_CHECKED_KEY,
+        app.config.get("FORUM_SESSION_CHECK_INTERVAL", 15 * 60),
+        digest,
+    )
+    browser._forum_session = digest
+
+
+def _load_session(browser):
+    "Gives browser the shared cookies, if there are any; returns their digest."
+    data = redis.get(SESSION_KEY)
+    if data is None:
+        return None
+    for c in json.loads(data):
+        browser.session.cookies.set_cookie(create_cookie(**c))
+    browser._forum_session = hashlib.sha1(data).hexdigest()
+    return browser._forum_session
+
+
+def _session_checked(browser):
+    digest = getattr(browser, "_forum_session", None)
+    return digest is not None and redis.get(SESSION_CHECKED_KEY) == digest.encode()
+
+
+def forget_session_check():
+    "Makes the next ensure_logged_in actually look at the site."
+    redis.delete(SESSION_CHECKED_KEY)
+
+
+def login(browser):
+    # temporary errors have already been retried by ForumAdapter
     browser.open("{}/login/".format(SITE_BASE))
     form = browser.get_form(method="post")
     if form is None:
-        if browser.response.status_code in _temp_codes and retry:
-            import time
-
-            time.sleep(1)
-            return login(browser, retry=False)
-
         if browser.response.status_code in _temp_codes:
             raise ValueError("{} on login".format(browser.response.status_code))
 
@@ -256,9 +451,13 @@ def login(browser, retry=True):
     browser.submit_form(form, submit=sub)
 
 
-def open_with_login(browser, url):
+def open_with_login(browser, url, retry=True):
     ensure_logged_in(browser)
     browser.open(url)
+    if retry and browser.find(id="elSignInLink") is not None:
+        # the shared session must have expired since it was last checked
+        forget_session_check()
+        return open_with_login(browser, url, retry=False)
     error_div = browser.parsed.select_one("#elError")
     if error_div:
         msg = error_div.select_one("#elErrorMessage").text
@@ -293,15 +492,38 @@ def is_logged_in(browser):
     raise ValueError("is `browser` on the forums?")
 
 
-def ensure_logged_in(browser):
+def _check_logged_in(browser):
     try:
-        if is_logged_in(browser):
-            return
+        return is_logged_in(browser)
     except (ValueError, RoboError):
         browser.open(SITE_BASE)
-        if is_logged_in(browser):
+        return is_logged_in(browser)
+
+
+def ensure_logged_in(browser):
+    """
+    Makes sure browser is logged into the forums, using the shared session if
+    there is one. Only looks at the site if nobody has checked the session
+    lately, and only logs in (once, for everyone) if it doesn't work.
+    """
+    if getattr(browser, "_forum_session", None) is None:
+        _load_session(browser)
+    if _session_checked(browser):
+        return
+    if _check_logged_in(browser):
+        _save_session(browser)
+        return
+
+    with redis_lock.Lock(redis, "lock_forum_login", expire=120):
+        # maybe someone else logged in while we were waiting
+        seen = getattr(browser, "_forum_session", None)
+        if _load_session(browser) != seen and (
+            _session_checked(browser) or _check_logged_in(browser)
+        ):
+            _save_session(browser)
             return
-    login(browser)
+        login(browser)
+        _save_session(browser)
 
 
 def send_pm(browser, to, subject, content):
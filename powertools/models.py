@@ -148,6 +148,30 @@ class ShowTVDB(BaseModel):
         return escape(u)
 
 
+# the search index: see powertools.search
+class ShowSearchTerm(BaseModel):
+    show = pw.ForeignKeyField(column_name='showid',
+                              model=Show, field='id',
+                              on_delete='cascade', on_update='cascade')
+    source = pw.CharField(max_length=1)  # see search.SOURCES
+    text = pw.TextField()
+    term = pw.CharField(max_length=255, index=True)  # search.normalize(text)
+
+    class Meta:
+        table_name = 'show_search_terms'
+
+
+class ShowSearchTrigram(BaseModel):
+    trigram = pw.CharField(max_length=3)
+    show = pw.ForeignKeyField(column_name='showid',
+                              model=Show, field='id',
+                              on_delete='cascade', on_update='cascade')
+
+    class Meta:
+        table_name = 'show_search_trigrams'
+        primary_key = pw.CompositeKey('trigram', 'show')
+
+
 class Episode(BaseModel):
     epid = pw.IntegerField()
     seasonid = pw.IntegerField()
@@ -0,0 +1,134 @@
+"""
+The data behind the main turfs page, built once and shared.
+
+Building it means reading every show, turf and TVDB link, so the result is
+pickled into redis under a version number, and also kept in memory by each
+process. Anything that changes what the page shows calls touch_overview
+(after committing), which bumps the version; with show_ids, the current
+overview is patched for just those shows rather than rebuilt from scratch.
+The only per-mod part, each row's my_info, is filled in per request by
+TurfsOverview.rows_for.
+"""
+from bisect import bisect_right
+from itertools import groupby, islice
+import pickle
+
+import redis_lock
+
+from .base import app, redis
+from .viewmodels import load_show_rows, sort_key, with_my_info
+
+VERSION_KEY = "turfs_overview_version"
+DATA_KEY = "turfs_overview:2:{}"  # bump the 2 when TurfsOverview changes shape
+
+
+def first_letter(row):
+    "The letter a row is listed under in the turfs table; # for non-letters."
+    c = sort_key(row)[0][:1]
+    return c if c.isalpha() else "#"
+
+
+class TurfsOverview:
+    """
+    rows is a list of (ShowRow, info) for every visible show, sorted by name;
+    info has n_mods and mod_info as turf_row.html wants them. by_mod maps
+    mod ids to {show id: MyInfo}.
+    """
+
+    def __init__(self, rows, by_mod):
+        self.rows = rows
+        self.by_mod = by_mod
+        self._summarize()
+
+    @classmethod
+    def build(cls, show_ids=None):
+        "Reads everything from the db, or just show_ids (for patch)."
+        return cls(*load_show_rows(show_ids))
+
+    def patch(self, show_ids):
+        "Re-reads just show_ids from the db."
+        show_ids = set(show_ids)
+        fresh = TurfsOverview.build(list(show_ids))
+        self.rows = [r for r in self.rows if r[0].id not in show_ids] + fresh.rows
+        self.rows.sort(key=lambda r: sort_key(r[0]))
+        for mine in self.by_mod.values():
+            for show_id in show_ids:
+                mine.pop(show_id, None)
+        for modid, mine in fresh.by_mod.items():
+            self.by_mod.setdefault(modid, {}).update(mine)
+        self._summarize()
+
+    def _summarize(self):
+        self.keys = [sort_key(row) for row, _ in self.rows]
+        self.firsts = [
+            (k, next(g)[0].id)
+            for k, g in groupby(self.rows, key=lambda r: first_letter(r[0]))
+        ]
+
+        n_postses = sorted(
+            row.n_posts() for row, _ in self.rows if row.n_posts() != "n/a"
+        )
+        self.hi_post_thresh = n_postses[int(len(n_postses) * 0.9)] if n_postses else 0
+
+    def rows_after(self, key=None):
+        "The rows whose sort_key comes after key (default: all of them), in order."
+        start = 0 if key is None else bisect_right(self.keys, key)
+        return islice(self.rows, start, None)
+
+    def rows_for(self, modid, now=None):
+        "The rows, with my_info (and in_last_year) filled in for modid."
+        return with_my_info(self.rows, self.by_mod.get(modid, {}), now=now)
+
+
+_memo = (None, None)  # (version, TurfsOverview) for this process
+
+
+def data_version():
+    "A number that goes up whenever shows, turfs, mods or TVDB links change."
+    return int(redis.get(VERSION_KEY) or 0)
+
+
+def _load(version):
+    data = redis.get(DATA_KEY.format(version))
+    if data is None:
+        return None
+    try:
+        return pickle.loads(data)
+    except (AttributeError, ImportError, pickle.UnpicklingError):
+        return None  # pickled by an older version of the code; rebuild it
+
+
+def _store(version, overview):
+    ttl = app.config.get("TURFS_OVERVIEW_TTL", 24 * 60 * 60)
+    redis.setex(DATA_KEY.format(version), ttl, pickle.dumps(overview, protocol=-1))
+
+
+def get_overview():
+    "The current TurfsOverview: from memory, from redis, or built fresh."
+    global _memo
+    version = data_version()
+    memo_version, overview = _memo
+    if memo_version == version:
+        return overview
+
+    overview = _load(version)
+    if overview is None:
+        overview = TurfsOverview.build()
+        _store(version, overview)
+    _memo = (version, overview)
+    return overview
+
+
+def touch_overview(show_ids=None):
+    """
+    Call after committing a change to shows, turfs, mods, or TVDB links.
+    With show_ids, patches the current overview (if there is one) for just
+    those shows; otherwise it'll be rebuilt when it's next needed.
+    """
+    with redis_lock.Lock(redis, "lock_turfs_overview", expire=60):
+        old_version = data_version()
+        overview = _load(old_version) if show_ids is not None else None
+        version = redis.incr(VERSION_KEY)
+        if overview is not None:
+            overview.patch(show_ids)
+            _store(version, overview)
@@ -0,0 +1,64 @@
+"""
+HTML parsing backends for scraping the forums.
+
+'soup' is BeautifulSoup, the way RoboBrowser does it: convenient, but slow on
+the big listing pages. 'lxml' builds an lxml.html tree straight from the
+response and finds things with XPath, which is several times faster. Code
+that has both versions picks one with parser_backend(); the bench_parse.py
+script checks they agree.
+"""
+from bs4 import UnicodeDammit
+import lxml.html
+
+from .base import app
+
+BACKENDS = ("soup", "lxml")
+
+
+def parser_backend(name=None):
+    "The backend to use: name, or FORUM_PARSER by default."
+    if name is None:
+        name = app.config.get("FORUM_PARSER", "lxml")
+    if name not in BACKENDS:
+        raise ValueError("unknown FORUM_PARSER {!r}".format(name))
+    return name
+
+
+def lxml_tree(br):
+    "The page open in br as an lxml.html tree; only parsed once per response."
+    resp = br.response
+    tree = getattr(resp, "_lxml_tree", None)
+    if tree is None:
+        # decode the way BeautifulSoup would, so both backends see the same text
+        markup = UnicodeDammit(resp.content, is_html=True).unicode_markup
+        tree = resp._lxml_tree = lxml.html.fromstring(markup)
+    return tree
+
+
+def has_class(name):
+    "An XPath predicate matching the CSS selector .name"
+    return 'contains(concat(" ", normalize-space(@class), " "), " {} ")'.format(name)
+
+
+def string(el):
+    "Like BeautifulSoup's .string: the text, if el has exactly one text node."
+    kids = list(el)
+    if not kids:
+        return el.text
+    if len(kids) == 1 and not el.text and not kids[0].tail:
+        return string(kids[0])
+    return None
+
+
+def stripped_strings(el):
+    "Like BeautifulSoup's .stripped_strings."
+    return [s.strip() for s in el.itertext() if s.strip()]
+
+
+def text(el):
+    "Like BeautifulSoup's .text."
+    return el.text_content()
+
+
+def outer_html(el):
+    return lxml.html.tostring(el, encoding="unicode")
@@ -0,0 +1,205 @@
+"""
+Searching for shows by name, including their TVDB names and aliases.
+
+Every name is normalized (unidecoded, lowercased, down to letters, digits and
+single spaces) into a ShowSearchTerm, and each three-character run in a
+show's terms is a ShowSearchTrigram, keyed by trigram. That's plain indexed
+tables, so it works the same on SQLite and MySQL. A show matches a query if
+the normalized query appears in one of its terms; with fuzzy, shows sharing
+most of the query's trigrams come after those as near misses.
+
+sync_search_index keeps the tables in step with the shows and TVDB tables;
+call it after committing changes to either. The tables are made, and filled
+the first time, by sync_search.py.
+"""
+from collections import namedtuple
+import json
+import math
+import re
+
+from peewee import chunked, fn
+import redis_lock
+from unidecode import unidecode
+
+from .base import db, redis
+from .helpers import strip_the
+from .models import Show, ShowSearchTerm, ShowSearchTrigram, ShowTVDB
+
+SOURCES = {"n": "name", "t": "TVDB name", "a": "TVDB alias"}
+_source_rank = {source: i for i, source in enumerate(SOURCES)}
+
+# a near miss needs at least this fraction of the query's trigrams
+FUZZY_SHARE = 0.6
+
+# text is the name that matched, which might be a TVDB name or alias;
+# exact is false for near misses
+SearchHit = namedtuple("SearchHit", ["id", "name", "source", "text", "exact"])
+
+def normalize(s):
+    words = re.findall(r"[a-z0-9]+", unidecode(s or "").lower())
+    return " ".join(words)[:255]
+
+
+def trigrams(term):
+    return {term[i : i + 3] for i in range(len(term) - 2)}
+
+
+def _wanted_terms(show_ids=None):
+    "{show id: {(source, text, term)}}, from the shows and their TVDB info."
+    shows = Show.select(Show.id, Show.name)
+    tvdbs = ShowTVDB.select(ShowTVDB.show, ShowTVDB.name, ShowTVDB.aliases)
+    if show_ids is not None:
+        shows = shows.where(Show.id << show_ids)
+        tvdbs = tvdbs.where(ShowTVDB.show << show_ids)
+
+    names = {}  # {show id: {term: (source, text)}}, the best source per term
+
+    def add(showid, source, text):
+        term = normalize(text)
+        if not term:
+            return
+        mine = names.setdefault(showid, {})
+        if term not in mine or _source_rank[source] < _source_rank[mine[term][0]]:
+            mine[term] = (source, text)
+
+    for showid, name in shows.tuples():
+        add(showid, "n", name)
+    for showid, name, aliases in tvdbs.tuples():
+        if showid not in names:
+            continue  # a TVDB link to a show that's outside show_ids
+        add(showid, "t", name)
+        for alias in json.loads(aliases or "[]"):
+            add(showid, "a", alias)
+
+    return {
+        showid: {(source, text, term) for term, (source, text) in mine.items()}
+        for showid, mine in names.items()
+    }
+
+
+def _stored_terms(show_ids=None):
+    terms = ShowSearchTerm.select(
+        ShowSearchTerm.show,
+        ShowSearchTerm.source,
+        ShowSearchTerm.text,
+        ShowSearchTerm.term,
+    )
+    if show_ids is not None:
+        terms = terms.where(ShowSearchTerm.show << show_ids)
+    stored = {}
+    for showid, *row in terms.tuples():
+        stored.setdefault(showid, set()).add(tuple(row))
+    return stored
+
+
+def sync_search_index(show_ids=None):
+    """
+    Brings the index up to date for show_ids (default: every show), only
+    rewriting shows whose names have changed. Returns how many that was.
+    """
+    if show_ids is not None:
+        show_ids = list(show_ids)
+    with redis_lock.Lock(redis, "lock_search_index", expire=300):
+        return _sync(show_ids)
+
+
+def _sync(show_ids):
+    wanted = _wanted_terms(show_ids)
+    stored = _stored_terms(show_ids)
+    stale = sorted(
+        showid
+        for showid in wanted.keys() | stored.keys()
+        if wanted.get(showid) != stored.get(showid)
+    )
+    if not stale:
+        return 0
+
+    term_rows = []
+    trigram_rows = []
+    for showid in stale:
+        grams = set()
+        for source, text, term in wanted.get(showid, ()):
+            term_rows.append(
+                {"show": showid, "source": source, "text": text, "term": term}
+            )
+            grams |= trigrams(term)
+        trigram_rows.extend({"show": showid, "trigram": g} for g in sorted(grams))
+
+    with db.atomic():
+        for batch in chunked(stale, 500):
+            ShowSearchTerm.delete().where(ShowSearchTerm.show << batch).execute()
+            ShowSearchTrigram.delete().where(
+                ShowSearchTrigram.show << batch
+            ).execute()
+        for batch in chunked(term_rows, 250):
+            ShowSearchTerm.insert_many(batch).execute()
+        for batch in chunked(trigram_rows, 400):
+            ShowSearchTrigram.insert_many(batch).execute()
+    return len(stale)
+
+
+def _candidates(term, need):
+    "A condition on ShowSearchTerm picking out the shows that might match."
+    grams = trigrams(term)
+    if not grams:
+        # too short for trigrams: scan the terms instead (terms are only
+        # letters, digits and spaces, so there are no wildcards to escape)
+        return ShowSearchTerm.term ** ("%" + term + "%")
+
+    n_shared = fn.COUNT(ShowSearchTrigram.trigram)
+    shows = (
+        ShowSearchTrigram.select(ShowSearchTrigram.show)
+        .where(ShowSearchTrigram.trigram << sorted(grams))
+        .group_by(ShowSearchTrigram.show)
+        .having(n_shared >= need)
+    )
+    return ShowSearchTerm.show << shows
+
+
+def search_shows(q, limit=None, fuzzy=True):
+    """
+    A list of SearchHits for the shows matching q, best first: those with a
+    term that is q, then starts with it, then has a word starting with it,
+    then just contains it; then near misses, if fuzzy. Deleted shows are
+    left out. One query.
+    """
+    term = normalize(q)
+    if not term:
+        return []
+    grams = trigrams(term)
+    need = math.ceil(len(grams) * FUZZY_SHARE) if fuzzy else len(grams)
+
+    rows = (
+        ShowSearchTerm.select(
+            ShowSearchTerm.show,
+            Show.name,
+            ShowSearchTerm.source,
+            ShowSearchTerm.text,
+            ShowSearchTerm.term,
+        )
+        .join(Show)
+        .where(_candidates(term, need), Show.deleted_at.is_null(True))
+    )
+
+    best = {}
+    for showid, name, source, text, t in rows.tuples():
+        pos = t.find(term)
+        if pos < 0:
+            kind = 4
+        elif t == term:
+            kind = 0
+        elif pos == 0:
+            kind = 1
+        elif t[pos - 1] == " ":
+            kind = 2
+        else:
+            kind = 3
+        shared = len(grams & trigrams(t))
+        if kind == 4 and (not fuzzy or shared < need):
+            continue
+        rank = (kind, -shared, _source_rank[source], strip_the(name).lower(), showid)
+        if showid not in best or rank < best[showid][0]:
+            best[showid] = (rank, SearchHit(showid, name, source, text, kind < 4))
+
+    hits = [hit for rank, hit in sorted(best.values())]
+    return hits if limit is None else hits[:limit]
@@ -1,16 +1,27 @@
+from array import array
+import bisect
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import datetime
+from functools import partial
+import itertools
 import json
 import logging
-import os
-from functools import partial
+import threading
+import time
 
-from cachecontrol import CacheControl
-from cachecontrol.caches import FileCache
+from celery import chord, group
 from flask import g
+from peewee import chunked
+import redis_lock
 import requests
 
-from .base import app, celery, db
-from .models import Episode, Show, ShowGenre, ShowTVDB
+from .base import app, celery, db, redis
+from .models import (Episode, Meta, Show, ShowGenre, ShowTVDB, Turf,
+                     TURF_LOOKUP)
+from .overview import touch_overview
+from .search import sync_search_index
+from .webcache import counting_session, make_cache
 
 logger = logging.getLogger('powertools')
 
@@ -34,32 +45,95 @@ class TVDBResponseError(ValueError, TVDBError):
     pass
 
 
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    "The process-wide HTTP cache for TVDB; see WEB_CACHE_* in the config."
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = make_cache(app.config, redis=redis)
+    return _cache
+
+
+def cache_stats():
+    "A Counter of the cache's stats so far; subtract an earlier one for a run."
+    return get_cache().snapshot()
+
+
 def _make_request(method, path, **kwargs):
     if 'cache_sess' not in g:
-        if os.path.exists('/dev/shm/'):
-            pth = '/dev/shm/{}/web_cache'.format(os.getuid())
-        else:
-            pth = os.path.expanduser('~/.web_cache')
-        g.cache_sess = CacheControl(requests.session(), FileCache(pth))
+        g.cache_sess = counting_session(get_cache())
 
     headers = kwargs.pop('headers', {})
     for k, v in HEADERS.items():
         headers.setdefault(k, v)
+    base = app.config.get('TVDB_API_BASE', API_BASE)
     return getattr(g.cache_sess, method)(
-        '{}{}'.format(API_BASE, path), headers=headers, **kwargs)
-
-
-def authenticate():
-    r = _make_request(
-        'post', 'login', json={'apikey': app.config['TVDB_API_KEY']})
-    assert r.status_code == 200, r.status_code
-    HEADERS['Authorization'] = 'Bearer ' + r.json()['token']
+        '{}{}'.format(base, path), headers=headers, **kwargs)
+
+
+# TVDB tokens last 24 hours; we keep the current one in redis, so that every
+# process shares it, and replace it a while before it runs out.
+TOKEN_KEY = 'tvdb_token'
+TOKEN_LIFETIME = 24 * 60 * 60
+TOKEN_REFRESH_MARGIN = 60 * 60
+_token_expires = 0
+
+
+def _use_token(token, ttl):
+    global _token_expires
+    HEADERS['Authorization'] = 'Bearer ' + token
+    _token_expires = time.time() + ttl
+
+
+def authenticate(stale_token=None):
+    """
+    Gets a new token, unless another process already replaced stale_token
+    in redis while we were waiting for the lock.
+    """
+    with redis_lock.Lock(redis, 'lock_tvdb_login', expire=60):
+        token = redis.get(TOKEN_KEY)
+        ttl = redis.ttl(TOKEN_KEY)
+        if (token is not None and token.decode() != stale_token
+                and ttl > TOKEN_REFRESH_MARGIN):
+            _use_token(token.decode(), ttl)
+            return
+
+        r = _make_request(
+            'post', 'login', json={'apikey': app.config['TVDB_API_KEY']})
+        assert r.status_code == 200, r.status_code
+        token = r.json()['token']
+        redis.setex(TOKEN_KEY, TOKEN_LIFETIME, token)
+        _use_token(token, TOKEN_LIFETIME)
+
+
+def current_token():
+    auth = HEADERS.get('Authorization')
+    return auth[len('Bearer '):] if auth else None
+
+
+def ensure_token():
+    "Picks up the shared token, or refreshes it if it's about to expire."
+    if _token_expires - time.time() > TOKEN_REFRESH_MARGIN:
+        return
+
+    token = redis.get(TOKEN_KEY)
+    ttl = redis.ttl(TOKEN_KEY)
+    if token is not None and ttl > TOKEN_REFRESH_MARGIN:
+        _use_token(token.decode(), ttl)
+    else:
+        authenticate(stale_token=current_token())
 
 
 def make_request(method, path, authenticate_if_error=True, **kwargs):
+    if authenticate_if_error:
+        ensure_token()
     resp = _make_request(method, path, **kwargs)
     if resp.status_code == 401 and authenticate_if_error:
-        authenticate()
+        authenticate(stale_token=current_token())
         resp = _make_request(method, path, **kwargs)
     return resp
 
@@ -94,8 +168,7 @@ def get_show_info(tvdb_id):
 ################################################################################
 ### Update the database with new episodes / genres / etc
 
-def fill_show_meta(tvdb):
-    show_info = get_show_info(tvdb.tvdb_id)
+def set_show_meta(tvdb, show_info):
     tvdb.name = show_info['seriesName'] or '(???)'
     tvdb.aliases = json.dumps(show_info['aliases'])
     tvdb.first_aired = show_info['firstAired'] or None
@@ -108,92 +181,330 @@ def fill_show_meta(tvdb):
     tvdb.zaptoit_id = show_info['zap2itId']
     tvdb.overview = show_info['overview'] or ''
     tvdb.slug = show_info['slug']
+
+
+def fill_show_meta(tvdb):
+    show_info = get_show_info(tvdb.tvdb_id)
+    set_show_meta(tvdb, show_info)
     return show_info
 
 
-@celery.task
-def update_series(tvdb_id):
-    with db.atomic():
-        # delete old info that we'll replace
-        Episode.delete().where(Episode.seriesid == tvdb_id).execute()
-        ShowGenre.delete().where(ShowGenre.seriesid == tvdb_id).execute()
+def get_episode_page(tvdb_id, page_num):
+    "One page of series/{id}/episodes; None if TVDB has no episodes at all."
+    path = 'series/{}/episodes'.format(tvdb_id)
+    r = get(path, params={'page': page_num})
 
-        # find the showid...
-        try:
-            tvdb = ShowTVDB.select(ShowTVDB, Show).join(Show) \
-                           .where(ShowTVDB.tvdb_id == tvdb_id).get()
-            show = tvdb.show
-        except ShowTVDB.DoesNotExist:
-            raise ValueError("No show matching tvdb id {}".format(tvdb_id))
+    try:
+        resp = r.json()
+    except json.decoder.JSONDecodeError as e:
+        if e.msg == "Expecting value" and e.lineno == 1 and e.pos == 0:
+            msg = "TVDB returned no content for {}?page={}"
+            raise TVDBResponseError(msg.format(path, page_num))
+        else:
+            raise
+
+    if 'data' not in resp:
+        if 'Error' in resp:
+            e = resp['Error']
+            if e.startswith('No results for your query:'):
+                # no known episodes for this series yet; that's okay
+                return None
+        else:
+            e = resp
+        raise TVDBResponseError('TVDB error on {}: {}'.format(path, e))
+    return resp
 
-        # update meta info; don't save until the end
-        show_info = fill_show_meta(tvdb)
 
-        # update genres
-        genres = show_info['genre'] or ['(none)']
+def iter_episode_pages(tvdb_id, page_workers=None):
+    """
+    Yields the pages of raw episode dicts for a series, in page order. Once
+    page 1 tells us how many pages there are, the rest are fetched up to
+    page_workers (default TVDB_PAGE_WORKERS) at a time, but never more than
+    that many pages ahead of whatever's consuming them.
+    """
+    if page_workers is None:
+        page_workers = app.config.get('TVDB_PAGE_WORKERS', 1)
+
+    resp = get_episode_page(tvdb_id, 1)
+    if resp is None:
+        return
+    yield resp['data']
+
+    last = resp['links'].get('last')
+    if last and last > 1 and page_workers > 1:
+        def fetch(page_num):
+            with app.app_context():
+                return get_episode_page(tvdb_id, page_num)
+
+        page_nums = iter(range(2, last + 1))
+        with ThreadPoolExecutor(max_workers=page_workers) as pool:
+            ahead = deque(pool.submit(fetch, n)
+                          for n in itertools.islice(page_nums, page_workers))
+            while ahead:
+                resp = ahead.popleft().result()
+                for n in itertools.islice(page_nums, 1):
+                    ahead.append(pool.submit(fetch, n))
+                if resp is not None:
+                    yield resp['data']
+    else:
+        page_num = resp['links']['next']
+        while page_num is not None:
+            resp = get_episode_page(tvdb_id, page_num)
+            if resp is None:
+                break
+            yield resp['data']
+            page_num = resp['links']['next']
+
+
+def iter_episodes(tvdb_id, page_workers=None):
+    for page in iter_episode_pages(tvdb_id, page_workers=page_workers):
+        yield from page
+
+
+def fetch_series(tvdb_id):
+    """
+    Gets the series info from TVDB, and a generator that fetches its
+    episodes lazily as store_series consumes them.
+    """
+    return get_show_info(tvdb_id), iter_episodes(tvdb_id)
+
+
+def _episode_row(tvdb_id, show, ep):
+    return {
+        'epid': ep['id'],
+        'seasonid': ep['airedSeasonID'],
+        'seriesid': tvdb_id,  # tvdb_id
+        'show': show.id,
+        'season_number': ep['airedSeason'] or '',
+        'episode_number': ep['airedEpisodeNumber'],
+        'name': ep['episodeName'],
+        'overview': ep['overview'],
+        'first_aired': (
+            None
+            if (not ep['firstAired'] or ep['firstAired'].startswith('0000'))
+            else ep['firstAired']
+        ),
+    }
+
+
+# columns we compare to decide whether a stored episode needs an update
+_episode_fields = [Episode.seasonid, Episode.show, Episode.season_number,
+                   Episode.episode_number, Episode.name, Episode.overview,
+                   Episode.first_aired]
+
+
+def _changed_fields(ep, row):
+    "Which of row's values differ from the stored Episode ep."
+    changes = {}
+    for field in _episode_fields:
+        # round-trip through the field so e.g. '2001-01-01' == date(2001, 1, 1)
+        new = field.python_value(field.db_value(row[field.name]))
+        if new != ep.__data__.get(field.name):
+            changes[field] = row[field.name]
+    return changes
+
+
+def sync_episodes(tvdb_id, show, episodes, stats, batch_size=None):
+    """
+    Writes only the episode rows that actually differ from what's stored.
+    episodes can be any iterable; it's consumed batch_size (default
+    TVDB_INSERT_BATCH_SIZE) at a time, with each batch committed on its own,
+    so memory use stays small and transactions short however big the series.
+    """
+    if batch_size is None:
+        batch_size = app.config.get('TVDB_INSERT_BATCH_SIZE', 100)
+
+    # the epids we have stored, sorted and packed, plus a flag byte for each
+    # saying whether tvdb still has it, so this stays small for huge series
+    stored = array('q', (
+        epid for epid, in Episode.select(Episode.epid).distinct()
+                                 .where(Episode.seriesid == tvdb_id)
+                                 .order_by(Episode.epid).tuples().iterator()))
+    seen = bytearray(len(stored))
+
+    dupes = []
+    rows = (_episode_row(tvdb_id, show, ep) for ep in episodes)
+    for batch in chunked(rows, batch_size):
+        batch = {row['epid']: row for row in batch}
+        for epid in batch:
+            i = bisect.bisect_left(stored, epid)
+            if i < len(stored) and stored[i] == epid:
+                seen[i] = 1
+
+        with db.atomic():
+            existing = Episode.select().where(
+                Episode.seriesid == tvdb_id, Episode.epid.in_(list(batch)))
+            changed = []
+            changed_names = set()
+            for ep in existing:
+                row = batch.pop(ep.epid, None)
+                if row is None:  # a duplicate row in the db
+                    dupes.append(ep.id)
+                    continue
+
+                changes = _changed_fields(ep, row)
+                if changes:
+                    for field, value in changes.items():
+                        setattr(ep, field.name, value)
+                    changed_names.update(field.name for field in changes)
+                    changed.append(ep)
+
+            if changed:
+                # one UPDATE for the lot, of just the columns that changed
+                fields = [f for f in _episode_fields if f.name in changed_names]
+                Episode.bulk_update(changed, fields=fields,
+                                    batch_size=batch_size)
+                stats['episodes_updated'] += len(changed)
+
+            if batch:
+                Episode.insert_many(list(batch.values())).execute()
+                stats['episodes_inserted'] += len(batch)
+
+    # anything we didn't see is gone from tvdb
+    gone = [epid for epid, was_seen in zip(stored, seen) if not was_seen]
+    if gone or dupes:
+        with db.atomic():
+            n = 0
+            for epids in chunked(gone, 500):
+                n += Episode.delete().where(Episode.seriesid == tvdb_id,
+                                            Episode.epid.in_(epids)).execute()
+            for ids in chunked(dupes, 500):
+                n += Episode.delete().where(Episode.id.in_(ids)).execute()
+        stats['episodes_deleted'] += n
+
+
+def sync_genres(tvdb_id, show, genres, stats):
+    genres = set(genres)
+    old = {sg.genre: sg.showid
+           for sg in ShowGenre.select().where(ShowGenre.seriesid == tvdb_id)}
+
+    gone = set(old) - genres
+    if gone:
+        ShowGenre.delete().where(ShowGenre.seriesid == tvdb_id,
+                                 ShowGenre.genre.in_(gone)).execute()
+        stats['genres_deleted'] += len(gone)
+
+    moved = [g for g in genres & set(old) if old[g] != show.id]
+    if moved:
+        ShowGenre.update(show=show).where(ShowGenre.seriesid == tvdb_id,
+                                          ShowGenre.genre.in_(moved)).execute()
+        stats['genres_updated'] += len(moved)
+
+    new = genres - set(old)
+    if new:
         ShowGenre.insert_many(
-            {'show': show, 'seriesid': tvdb_id, 'genre': g} for g in genres
+            {'show': show, 'seriesid': tvdb_id, 'genre': g} for g in new
         ).execute()
+        stats['genres_inserted'] += len(new)
 
-        # update episodes
-        page_num = 1
-        while page_num is not None:
-            path = 'series/{}/episodes'.format(tvdb_id)
-            r = get(path, params={'page': page_num})
-
-            try:
-                resp = r.json()
-            except json.decoder.JSONDecodeError as e:
-                if e.msg == "Expecting value" and e.lineno == 1 and e.pos == 0:
-                    msg = "TVDB returned no content for {}?page={}"
-                    raise TVDBResponseError(msg.format(path, page_num))
-                else:
-                    raise
-
-            if 'data' in resp:
-                Episode.insert_many([{
-                    'epid': ep['id'],
-                    'seasonid': ep['airedSeasonID'],
-                    'seriesid': tvdb_id,  # tvdb_id
-                    'show': show,
-                    'season_number': ep['airedSeason'] or '',
-                    'episode_number': ep['airedEpisodeNumber'],
-                    'name': ep['episodeName'],
-                    'overview': ep['overview'],
-                    'first_aired': (
-                        None
-                        if (not ep['firstAired'] or ep['firstAired'].startswith('0000'))
-                        else ep['firstAired']
-                    ),
-                } for ep in resp['data']]).execute()
-
-                page_num = resp['links']['next']
-            else:
-                if 'Error' in resp:
-                    e = resp['Error']
-                    if e.startswith('No results for your query:'):
-                        # no known episodes for this series yet; that's okay
-                        break
-                else:
-                    e = resp
-                raise TVDBResponseError('TVDB error on {}: {}'.format(path, e))
+
+def store_series(tvdb_id, show_info, episodes, stats=None):
+    """
+    Writes the results of fetch_series to the database, touching only the
+    Episode and ShowGenre rows that changed. Counts of rows written go into
+    the stats Counter, if given.
+
+    Episodes are committed in batches as they stream in, so if this dies
+    partway through, the series is left half-updated, but last_synced isn't
+    touched and the next sync will finish the job.
+    """
+    if stats is None:
+        stats = Counter()
+
+    # find the showid...
+    try:
+        tvdb = ShowTVDB.select(ShowTVDB, Show).join(Show) \
+                       .where(ShowTVDB.tvdb_id == tvdb_id).get()
+        show = tvdb.show
+    except ShowTVDB.DoesNotExist:
+        raise ValueError("No show matching tvdb id {}".format(tvdb_id))
+
+    # update meta info; don't save until the end
+    set_show_meta(tvdb, show_info)
+
+    sync_episodes(tvdb_id, show, episodes, stats)
+
+    with db.atomic():
+        sync_genres(tvdb_id, show, show_info['genre'] or ['(none)'], stats)
 
         # mark on the ShowTVDB that it's been synced
         tvdb.last_synced = datetime.datetime.utcnow()
         tvdb.save()
+    return stats
+
+
+def show_ids_for(tvdb_ids):
+    "The ids of the shows linked to any of tvdb_ids."
+    show_ids = set()
+    for batch in chunked(tvdb_ids, 500):
+        query = ShowTVDB.select(ShowTVDB.show).where(ShowTVDB.tvdb_id << batch)
+        show_ids.update(st.showid for st in query)
+    return sorted(show_ids)
 
 
 @celery.task
-def update_serieses(ids, verbose=False):
+def update_series(tvdb_id):
+    store_series(tvdb_id, *fetch_series(tvdb_id))
+    show_ids = show_ids_for([tvdb_id])
+    touch_overview(show_ids)
+    sync_search_index(show_ids)
+
+
+def _fetch_concurrently(ids, workers):
+    """
+    Runs fetch_series on a thread pool, yielding (tvdb_id, fut.result) pairs
+    as they finish. Episodes are read into memory here, rather than streamed,
+    but only a couple of series per worker are in flight at once, so we don't
+    pile up fetched data faster than the db can take it.
+    """
+    def fetch(tvdb_id):
+        # each thread needs its own app context, for the session in g
+        with app.app_context():
+            show_info, episodes = fetch_series(tvdb_id)
+            return show_info, list(episodes)
+
+    ids = iter(ids)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(fetch, i): i
+                   for i in itertools.islice(ids, 2 * workers)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                tvdb_id = pending.pop(fut)
+                for nxt in itertools.islice(ids, 1):
+                    pending[pool.submit(fetch, nxt)] = nxt
+                yield tvdb_id, fut.result
+
+
+@celery.task
+def update_serieses(ids, verbose=False, workers=None, stats=None):
+    """
+    Syncs each of the TVDB ids. With workers > 1, the HTTP requests for
+    different series happen in parallel, but all the database writes still
+    happen here, one series at a time. Row counts are added to stats, if
+    it's passed in.
+    """
+    if stats is None:
+        stats = Counter()
+    if workers is None:
+        workers = app.config.get('TVDB_SYNC_WORKERS', 1)
     if verbose:
         from tqdm import tqdm
-        ids = tqdm(ids)
+        pbar = tqdm(total=len(ids))
     bad_ids = set()
     not_found_ids = set()
+    synced_ids = []
+    cache_before = cache_stats()
+
+    if workers > 1:
+        fetched = _fetch_concurrently(ids, workers)
+    else:
+        fetched = ((i, partial(fetch_series, i)) for i in ids)
 
-    for i, tvdb_id in enumerate(ids, 1):
+    for tvdb_id, get_result in fetched:
         try:
-            update_series(tvdb_id)
+            store_series(tvdb_id, *get_result(), stats=stats)
+            synced_ids.append(tvdb_id)
         except (TVDBResponseError, requests.exceptions.HTTPError) as e:
             logger.error("{}: {}".format(tvdb_id, e))
             bad_ids.add(tvdb_id)
@@ -201,61 +512,245 @@ def update_serieses(ids, verbose=False):
                     .where(ShowTVDB.tvdb_id == tvdb_id).execute()
         except TVDBKeyError:
             not_found_ids.add(tvdb_id)
+        if verbose:
+            pbar.update()
 
+    if verbose:
+        pbar.close()
+    show_ids = show_ids_for(synced_ids)
+    if show_ids:
+        touch_overview(show_ids)
+        sync_search_index(show_ids)
+    logger.info("TVDB sync rows: {}".format(
+        ', '.join('{} {}'.format(v, k) for k, v in sorted(stats.items()))
+        or 'none touched'))
+    cache = cache_stats() - cache_before
+    logger.info("TVDB cache: {}".format(', '.join(
+        '{} {}'.format(v, k) for k, v in sorted(cache.items()))
+        or 'unused'))
     return bad_ids, not_found_ids
 
 
-def update_db(force=False, verbose=False):
+# update_db keeps track of how far it's gotten through updated/query in the
+# Meta table, along with the series it's found changes for but not yet synced,
+# so a crash doesn't lose track of anything.
+WATERMARK_KEY = 'tvdb_update_watermark'
+PENDING_KEY = 'tvdb_update_pending'
+# updated/query won't answer for more than a week at a time
+UPDATE_WINDOW = 7 * 24 * 60 * 60
+
+
+def get_updated_ids(from_time, to_time):
+    "TVDB ids of the series that changed in [from_time, to_time]."
+    r = get('updated/query',
+            params={'fromTime': int(from_time), 'toTime': int(to_time)})
+
+    if r.status_code not in {200, 404}:
+        msg = "Response code {}: {}".format(r.status_code, r.content)
+        raise TVDBResponseError(msg)
+
+    # 404 just means no updates
+    if r.status_code == 200:
+        resp = r.json()
+        if 'data' in resp and resp['data'] is not None:
+            return {d['id'] for d in resp['data']}
+    return set()
+
+
+def get_pending():
+    return set(json.loads(Meta.get_value(PENDING_KEY, '[]')))
+
+
+def save_progress(pending, watermark=None):
+    with db.atomic():
+        if watermark is not None:
+            Meta.set_value(WATERMARK_KEY, watermark)
+        Meta.set_value(PENDING_KEY, json.dumps(sorted(pending)))
+
+
+def mark_synced(ids):
+    save_progress(get_pending() - set(ids))
+
+
+# How many days we'll go without re-syncing a series, even if TVDB hasn't
+# told us about any changes, depending on how much anyone cares about it.
+REFRESH_DAYS = {
+    'airing': 1,          # has an episode in the next AIRING_SOON_DAYS
+    'turfed': 3,          # a mod leads / backs up the show
+    'continuing': 7,
+    'ended_turfed': 14,
+    'ended': 30,          # over, and nobody's looking after it
+}
+AIRING_SOON_DAYS = 7
+# Each day's changed series go in a redis set of their own: a series that the
+# overlapping update windows both report is only counted once, and changes
+# older than CHANGES_DAYS stop counting, so one busy spell doesn't last.
+CHANGES_KEY = 'tvdb_changes:{}'
+CHANGES_SINCE_KEY = 'tvdb_changes_since'
+CHANGES_DAYS = 28
+
+
+def record_changes(ids, when):
+    "Notes in redis that TVDB reported changes to ids on when's (UTC) day."
+    if not ids:
+        return
+    redis.setnx(CHANGES_SINCE_KEY, time.time())
+    key = CHANGES_KEY.format(datetime.datetime.utcfromtimestamp(when).date())
+    pipe = redis.pipeline()
+    pipe.sadd(key, *ids)
+    pipe.expire(key, (CHANGES_DAYS + 1) * 24 * 60 * 60)
+    pipe.execute()
+
+
+def changes_per_week():
+    "How many days a week each series changed on, over the last CHANGES_DAYS."
+    now = time.time()
+    since = float(redis.get(CHANGES_SINCE_KEY) or now)
+    days = min(CHANGES_DAYS, (now - since) / (24 * 60 * 60))
+    weeks = max(1, days / 7)
+
+    today = datetime.datetime.utcfromtimestamp(now).date()
+    pipe = redis.pipeline()
+    for i in range(CHANGES_DAYS):
+        pipe.smembers(CHANGES_KEY.format(today - datetime.timedelta(days=i)))
+    counts = Counter()
+    for ids in pipe.execute():
+        counts.update(int(tvdb_id) for tvdb_id in ids)
+    return {tvdb_id: n / weeks for tvdb_id, n in counts.items()}
+
+
+def refresh_tiers(today=None):
+    "Maps each tvdb_id to its REFRESH_DAYS key."
+    if today is None:
+        today = datetime.date.today()
+    soon = today + datetime.timedelta(days=AIRING_SOON_DAYS)
+
+    airing = {
+        ep.seriesid for ep in
+        Episode.select(Episode.seriesid).distinct()
+               .where(Episode.first_aired.between(today, soon))
+    }
+    turfed = {
+        st.tvdb_id for st in
+        ShowTVDB.select(ShowTVDB.tvdb_id).distinct()
+                .join(Turf, on=(Turf.show == ShowTVDB.show))
+                .where(Turf.state.in_([TURF_LOOKUP['lead'],
+                                       TURF_LOOKUP['backup']]))
+    }
+
+    tiers = {}
+    for st in ShowTVDB.select(ShowTVDB.tvdb_id, ShowTVDB.status):
+        if st.tvdb_id in airing:
+            tier = 'airing'
+        elif st.status == 'Ended':
+            tier = 'ended_turfed' if st.tvdb_id in turfed else 'ended'
+        else:
+            tier = 'turfed' if st.tvdb_id in turfed else 'continuing'
+        tiers[st.tvdb_id] = tier
+    return tiers
+
+
+def due_for_refresh(last_synced, now=None):
+    """
+    The series whose last sync is older than their refresh interval. Series
+    that TVDB often reports changes for get a shorter interval, down to a day.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    days = app.config.get('TVDB_REFRESH_DAYS', REFRESH_DAYS)
+    rates = changes_per_week()
+
+    due = set()
+    counts = Counter()
+    for tvdb_id, tier in refresh_tiers(now.date()).items():
+        interval = days[tier]
+        rate = rates.get(tvdb_id, 0)
+        if rate > 0:
+            interval = max(1, min(interval, 7 / rate))
+
+        t = last_synced.get(tvdb_id)
+        if t is None or now - t >= datetime.timedelta(days=interval):
+            due.add(tvdb_id)
+            counts[tier] += 1
+
+    logger.info("TVDB refreshes due: {}".format(
+        ', '.join('{} {}'.format(v, k) for k, v in sorted(counts.items()))
+        or 'none'))
+    return due
+
+
+def find_updates():
+    """
+    Walks updated/query forward from the stored watermark, a week-long window
+    at a time, adding the changed series we know about to the stored pending
+    set. Returns everything pending, plus anything that's due for a refresh
+    according to due_for_refresh.
+    """
+    # MySQL (or peewee at least) doesn't have proper TZ support.
+    # everything here is a "naive" datetime in UTC
+    ours = {}
+    for st in ShowTVDB.select(ShowTVDB.tvdb_id, ShowTVDB.last_synced):
+        ours[st.tvdb_id] = st.last_synced
+
+    pending = get_pending()
+    now = time.time()
+    watermark = Meta.get_value(WATERMARK_KEY)
+    if watermark is None:
+        # first run: anything old is due anyway; ask about the last week
+        watermark = now - UPDATE_WINDOW + 10
+    else:
+        watermark = float(watermark)
+
+    while watermark < now:
+        # a little overlap, in case of clock weirdness
+        from_time = watermark - 10
+        to_time = min(from_time + UPDATE_WINDOW, now)
+        changed = get_updated_ids(from_time, to_time) & set(ours)
+        record_changes(changed, to_time)
+        pending |= changed
+        watermark = to_time
+        save_progress(pending, watermark)
+
+    return (pending | due_for_refresh(ours)) & set(ours)
+
+
+def update_db(force=False, verbose=False, workers=None, chunk_size=None,
+              stats=None):
+    """
+    Syncs every series that TVDB says has changed since last time, or that's
+    due for a refresh anyway (or everything, with force). If chunk_size is
+    given (or TVDB_SYNC_CHUNK_SIZE is set), the work is split up into a celery
+    chord of update_series_chunk tasks, and this returns the AsyncResult for
+    the finish_update_db callback instead of doing the work here; otherwise,
+    row counts go into stats.
+    """
     if force:
         needs_update = {st.tvdb_id for st in ShowTVDB.select(ShowTVDB.tvdb_id)}
+        save_progress(needs_update, time.time())
     else:
-        # MySQL (or peewee at least) doesn't have proper TZ support.
-        # everything here is a "naive" datetime in UTC
-        needs_update = set()
-        recently_updated = set()
-
-        # sort ShowTVDBs into ones updated in the last week, or not
-        # also track last update time for ones updated within last week
-        # (so fresh entries don't "invalidate" everything)
-        now = datetime.datetime.utcnow()
-        long_ago = now - datetime.timedelta(days=7)
-        last_update = now
-        for st in ShowTVDB.select(ShowTVDB.tvdb_id, ShowTVDB.last_synced):
-            t = st.last_synced
-            if t < long_ago:
-                needs_update.add(st.tvdb_id)
-            else:
-                recently_updated.add(st.tvdb_id)
-                if t < last_update:
-                    last_update = t
-
-        # what's been updated since last check?
-        if recently_updated:
-            last_time = last_update.replace(tzinfo=datetime.timezone.utc).timestamp()
-            r = get('updated/query', params={'fromTime': last_time - 10})
-
-            if r.status_code not in {200, 404}:
-                msg = "Response code {}: {}".format(r.status_code, r.content)
-                raise TVDBResponseError(msg)
-
-            # 404 just means no updates
-            if r.status_code == 200:
-                resp = r.json()
-                if 'data' in resp and resp['data'] is not None:
-                    new = {d['id'] for d in r.json()['data']}
-                    needs_update |= new
-                    recently_updated -= new
-
-        # stuff that hasn't changed since the last time we touched it
-        # doesn't need anything
-        ShowTVDB.update(last_synced=now) \
-                .where(ShowTVDB.tvdb_id.in_(recently_updated)) \
-                .execute()
-
-    bad_ids, not_found_ids = update_serieses(needs_update, verbose=verbose)
+        needs_update = find_updates()
+
+    if chunk_size is None:
+        chunk_size = app.config.get('TVDB_SYNC_CHUNK_SIZE')
+    if chunk_size and needs_update:
+        ids = sorted(needs_update)
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+        header = group(update_series_chunk.s(chunk, workers=workers)
+                       for chunk in chunks)
+        return chord(header)(finish_update_db.s())
+
+    bad_ids, not_found_ids = update_serieses(
+        needs_update, verbose=verbose, workers=workers, stats=stats)
     if verbose and (bad_ids or not_found_ids):
         logger.error("TVDB failures on:", sorted(bad_ids | not_found_ids))
 
+    # bad ones stay pending, to try again next time
+    mark_synced(needs_update - bad_ids)
+    remove_dead_ids(not_found_ids)
+
+
+def remove_dead_ids(not_found_ids):
+    show_ids = []
     if len(not_found_ids) < 10:
         for dead_id in not_found_ids:
             with db.atomic():
@@ -265,11 +760,61 @@ def update_db(force=False, verbose=False):
                 logger.warning(
                     "{}: deleting bad tvdb id {} ({} others)".format(
                         s, dead_id, other_ids))
+                show_ids.append(s.id)
                 st.delete_instance()
                 Episode.delete().where(Episode.seriesid == dead_id).execute()
                 if not other_ids:
                     s.tvdb_not_matched_yet = True
                     s.save()
+    if not_found_ids and len(not_found_ids) < 10:
+        touch_overview(show_ids)
+        sync_search_index(show_ids)
 
     for h in logger.handlers:
         h.flush()
+
+
+@celery.task
+def update_series_chunk(ids, workers=None):
+    "One piece of a distributed update_db; results go to finish_update_db."
+    start = time.time()
+    stats = Counter()
+    bad_ids, not_found_ids = update_serieses(ids, workers=workers, stats=stats)
+    return {
+        'n': len(ids),
+        'ids': list(ids),
+        'seconds': time.time() - start,
+        'rows': dict(stats),
+        'bad_ids': sorted(bad_ids),
+        'not_found_ids': sorted(not_found_ids),
+    }
+
+
+@celery.task
+def finish_update_db(results):
+    bad_ids = set()
+    not_found_ids = set()
+    done_ids = set()
+    rows = Counter()
+    for i, res in enumerate(results):
+        logger.info("TVDB chunk {}: {} series in {:.1f}s ({} bad, {} missing)"
+                    .format(i, res['n'], res['seconds'],
+                            len(res['bad_ids']), len(res['not_found_ids'])))
+        bad_ids.update(res['bad_ids'])
+        not_found_ids.update(res['not_found_ids'])
+        rows.update(res['rows'])
+        done_ids.update(res['ids'])
+
+    if bad_ids or not_found_ids:
+        logger.error("TVDB failures on: {}".format(
+            sorted(bad_ids | not_found_ids)))
+
+    mark_synced(done_ids - bad_ids)
+    remove_dead_ids(not_found_ids)
+    return {
+        'bad_ids': sorted(bad_ids),
+        'not_found_ids': sorted(not_found_ids),
+        'rows': dict(rows),
+        'chunks': [{'n': res['n'], 'seconds': res['seconds']}
+                   for res in results],
+    }
@@ -0,0 +1,263 @@
+"""
+A local stand-in for the bits of the TVDB v3 API that powertools.tvdb uses:
+login, series/{id}, series/{id}/episodes, updated/query, and search/series.
+
+It serves either synthetic fixtures or ones recorded from the real API (see
+bench_tvdb.py record), with optional latency and injected errors, and counts
+the calls it gets. Point TVDB_API_BASE at it, e.g.
+
+    python -m powertools.tvdb_standin --series 500 --port 8765
+
+and TVDB_API_BASE = 'http://localhost:8765/'.
+"""
+from collections import Counter
+import json
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+PAGE_SIZE = 100
+MAX_UPDATE_WINDOW = 7 * 24 * 60 * 60
+
+
+class Fixtures:
+    """
+    What the stand-in knows about: series maps tvdb_id to a dict with the
+    series/{id} 'info', the list of raw 'episodes', and 'last_updated'.
+    """
+    def __init__(self, series):
+        self.series = series
+        self.lock = threading.Lock()
+
+    @classmethod
+    def synthetic(cls, n_series, min_episodes=1, max_episodes=300,
+                  first_id=70000, seed=0):
+        rng = random.Random(seed)
+        now = int(time.time())
+        series = {}
+        for tvdb_id in range(first_id, first_id + n_series):
+            n = int(rng.paretovariate(1.2) * min_episodes * 10)
+            n = max(min_episodes, min(max_episodes, n))
+            status = rng.choice(['Continuing', 'Ended', 'Ended'])
+            series[tvdb_id] = {
+                'info': synthetic_info(tvdb_id, status),
+                'episodes': [synthetic_episode(tvdb_id, i) for i in range(n)],
+                'last_updated': now - rng.randrange(30 * 24 * 60 * 60),
+            }
+        return cls(series)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            series = json.load(f)
+        return cls({int(k): v for k, v in series.items()})
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({str(k): v for k, v in self.series.items()}, f)
+
+    def touch(self, ids, when=None):
+        "Makes a small change to each series, as if someone edited it."
+        when = int(time.time() if when is None else when)
+        with self.lock:
+            for tvdb_id in ids:
+                s = self.series[tvdb_id]
+                if s['episodes']:
+                    ep = s['episodes'][-1]
+                    ep['overview'] = (ep['overview'] or '') + ' (edited)'
+                s['last_updated'] = when
+
+
+def synthetic_info(tvdb_id, status='Continuing'):
+    return {
+        'id': tvdb_id,
+        'seriesName': 'Synthetic Show {}'.format(tvdb_id),
+        'aliases': [],
+        'firstAired': '2001-01-01',
+        'network': 'Stand-in',
+        'airsDayOfWeek': 'Monday',
+        'airsTime': '8:00 PM',
+        'runtime': '60',
+        'status': status,
+        'imdbId': '',
+        'zap2itId': '',
+        'overview': 'A show that exists only for benchmarking.',
+        'slug': 'synthetic-show-{}'.format(tvdb_id),
+        'genre': ['Drama'],
+    }
+
+
+def synthetic_episode(tvdb_id, i):
+    season, number = divmod(i, 22)
+    return {
+        'id': tvdb_id * 10000 + i,
+        'airedSeasonID': tvdb_id * 100 + season,
+        'airedSeason': season + 1,
+        'airedEpisodeNumber': number + 1,
+        'episodeName': 'Episode {}'.format(i + 1),
+        'overview': 'Things happen.',
+        'firstAired': '{:04d}-01-01'.format(2001 + season),
+    }
+
+
+def make_app(fixtures, latency=0, jitter=0, error_rate=0, token_lifetime=None,
+             seed=None):
+    """
+    latency and jitter are in seconds; error_rate is the chance that any given
+    request gets a 503. With token_lifetime (seconds), tokens stop working
+    after that long, so the client has to log in again.
+    """
+    standin = Flask(__name__)
+    standin.calls = Counter()
+    tokens = {}
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    def error(msg, status):
+        r = jsonify(Error=msg)
+        r.status_code = status
+        return r
+
+    @standin.before_request
+    def pretend_to_be_far_away():
+        standin.calls[request.url_rule.endpoint if request.url_rule else '?'] += 1
+        with rng_lock:
+            delay = latency + rng.uniform(0, jitter)
+            fail = rng.random() < error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return error('Injected failure', 503)
+
+        if request.endpoint not in {'login', None}:
+            auth = request.headers.get('Authorization', '')
+            expires = tokens.get(auth[len('Bearer '):])
+            if expires is None or expires < time.time():
+                return error('Not Authorized', 401)
+
+    @standin.route('/login', methods=['POST'])
+    def login():
+        token = uuid.uuid4().hex
+        tokens[token] = time.time() + (token_lifetime or float('inf'))
+        return jsonify(token=token)
+
+    @standin.route('/series/<int:tvdb_id>')
+    def series(tvdb_id):
+        s = fixtures.series.get(tvdb_id)
+        if s is None:
+            return error('ID: {} not found'.format(tvdb_id), 404)
+        return jsonify(data=s['info'])
+
+    @standin.route('/series/<int:tvdb_id>/episodes')
+    def episodes(tvdb_id):
+        page = request.args.get('page', 1, type=int)
+        s = fixtures.series.get(tvdb_id)
+        eps = s['episodes'] if s is not None else []
+        last = (len(eps) + PAGE_SIZE - 1) // PAGE_SIZE
+        if not 1 <= page <= last:
+            return error('No results for your query: map[page:{}]'.format(page),
+                         404)
+        return jsonify(
+            data=eps[(page - 1) * PAGE_SIZE:page * PAGE_SIZE],
+            links={
+                'first': 1,
+                'last': last,
+                'next': page + 1 if page < last else None,
+                'prev': page - 1 if page > 1 else None,
+            })
+
+    @standin.route('/updated/query')
+    def updated():
+        from_time = request.args.get('fromTime', type=int)
+        to_time = request.args.get('toTime', type=int)
+        if from_time is None:
+            return error('fromTime is required', 400)
+        if to_time is None:
+            to_time = from_time + MAX_UPDATE_WINDOW
+        if to_time - from_time > MAX_UPDATE_WINDOW:
+            return error('toTime must be within a week of fromTime', 400)
+
+        data = [{'id': tvdb_id, 'lastUpdated': s['last_updated']}
+                for tvdb_id, s in fixtures.series.items()
+                if from_time <= s['last_updated'] <= to_time]
+        if not data:
+            return error('No results for your query', 404)
+        return jsonify(data=data)
+
+    @standin.route('/search/series')
+    def search():
+        name = request.args.get('name', '').lower()
+        slug = request.args.get('slug')
+        data = []
+        for s in fixtures.series.values():
+            info = s['info']
+            if slug is not None:
+                hit = info['slug'] == slug
+            else:
+                hit = name in info['seriesName'].lower()
+            if hit:
+                data.append({k: info[k] for k in
+                             ['id', 'seriesName', 'aliases', 'firstAired',
+                              'network', 'overview', 'slug', 'status']})
+        if not data:
+            return error('Resource not found', 404)
+        return jsonify(data=data)
+
+    return standin
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class StandinServer:
+    "Runs a stand-in app on a background thread; use as a context manager."
+    def __init__(self, standin, host='127.0.0.1', port=0):
+        self.standin = standin
+        self.server = make_server(host, port, standin, threaded=True,
+                                  request_handler=_QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.server.host, self.server.port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', help="JSON file from bench_tvdb.py record")
+    parser.add_argument('--series', type=int, default=200,
+                        help="number of synthetic series, without --fixtures")
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        fixtures = Fixtures.load(args.fixtures)
+    else:
+        fixtures = Fixtures.synthetic(args.series)
+    standin = make_app(fixtures, latency=args.latency, jitter=args.jitter,
+                       error_rate=args.error_rate)
+    standin.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
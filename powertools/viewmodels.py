@@ -0,0 +1,157 @@
+"""
+Plain, read-only versions of shows for the templates, loaded up front.
+
+Rendering straight from models lets the templates run queries of their own
+(a turf_set here, a lazy turf.mod there), one or more per show. The loaders
+here instead read everything a page needs for any number of shows in a fixed
+handful of queries, and hand back namedtuples that can't query anything.
+"""
+from collections import OrderedDict, defaultdict, namedtuple
+import datetime
+
+from .helpers import strip_the
+from .models import (
+    Mod,
+    Show,
+    ShowTVDB,
+    Turf,
+    PUBLIC_TURF_LOOKUP,
+    TURF_LOOKUP,
+    TURF_ORDER,
+)
+
+ModInfo = namedtuple("ModInfo", ["modname", "state", "comments"])
+MyInfo = namedtuple("MyInfo", ["state", "comments"])
+NO_INFO = MyInfo(None, None)
+
+
+class TVDBLink(namedtuple("TVDBLink", ["name", "tvdb_id", "slug"])):
+    "Just enough of a ShowTVDB for the tvdb_links filter."
+    __slots__ = ()
+    tvdb_url = ShowTVDB.tvdb_url
+
+
+class ShowRow(
+    namedtuple(
+        "ShowRow",
+        [
+            "id",
+            "name",
+            "forum_posts",
+            "forum_topics",
+            "last_post",
+            "gone_forever",
+            "is_a_tv_show",
+            "needs_help",
+            "has_forum",
+            "tvdb_ids",
+        ],
+    )
+):
+    "Just enough of a Show for turf_row.html."
+    __slots__ = ()
+    n_posts = Show.n_posts
+
+
+ShowPage = namedtuple("ShowPage", ["show", "turfs", "my_state", "tvdbs"])
+
+_row_fields = [getattr(Show, f) for f in ShowRow._fields if f != "tvdb_ids"]
+_counts = {TURF_LOOKUP["lead"], TURF_LOOKUP["backup"]}
+
+
+def sort_key(row):
+    return strip_the(row.name).lower(), row.id
+
+
+def _turfs_with_mods(show_ids=None):
+    turfs = Turf.select(Turf.show, Turf.mod, Turf.state, Turf.comments, Mod.name)
+    turfs = turfs.join(Mod)
+    if show_ids is not None:
+        turfs = turfs.where(Turf.show << show_ids)
+    return turfs.tuples()
+
+
+def load_show_rows(show_ids=None, visible_only=True):
+    """
+    A list of (ShowRow, info) for show_ids (default: every show), sorted by
+    name, with info's n_mods and mod_info as turf_row.html wants them; and a
+    dict mapping mod ids to {show id: MyInfo}. Three queries, however many
+    shows there are. With visible_only, hidden or deleted shows are left out.
+    """
+    shows = Show.select(*_row_fields)
+    if visible_only:
+        shows = shows.where(~Show.hidden, Show.deleted_at.is_null(True))
+    tvdbs = ShowTVDB.select(
+        ShowTVDB.show, ShowTVDB.name, ShowTVDB.tvdb_id, ShowTVDB.slug
+    )
+    if show_ids is not None:
+        shows = shows.where(Show.id << show_ids)
+        tvdbs = tvdbs.where(ShowTVDB.show << show_ids)
+
+    links = defaultdict(list)
+    for showid, name, tvdb_id, slug in tvdbs.tuples():
+        links[showid].append(TVDBLink(name, tvdb_id, slug))
+
+    mod_info = defaultdict(list)
+    by_mod = defaultdict(dict)
+    for showid, modid, state, comments, modname in _turfs_with_mods(show_ids):
+        mod_info[showid].append(ModInfo(modname, state, comments))
+        by_mod[modid][showid] = MyInfo(state, comments)
+
+    rows = []
+    for data in shows.tuples():
+        row = ShowRow(*data, tvdb_ids=links.get(data[0], []))
+        infos = sorted(
+            mod_info.get(row.id, []),
+            key=lambda info: (TURF_ORDER.find(info.state), info.modname.lower()),
+        )
+        n_mods = sum(1 for info in infos if info.state in _counts)
+        rows.append((row, {"n_mods": n_mods, "mod_info": infos}))
+    rows.sort(key=lambda r: sort_key(r[0]))
+    return rows, dict(by_mod)
+
+
+def with_my_info(rows, mine, now=None):
+    "rows, with my_info (from mine, {show id: MyInfo}) and in_last_year added."
+    if now is None:
+        now = datetime.datetime.now()
+    one_year_ago = now - datetime.timedelta(days=365)
+    return [
+        (
+            row,
+            dict(
+                info,
+                my_info=mine.get(row.id, NO_INFO),
+                in_last_year=(
+                    row.last_post is not None and row.last_post >= one_year_ago
+                ),
+            ),
+        )
+        for row, info in rows
+    ]
+
+
+def load_show_page(show_id, modid=None):
+    """
+    A ShowPage for show.html, or None if there's no such show: the Show
+    itself; an OrderedDict from each public turf state name to the ModInfos
+    in it, by mod name; modid's MyInfo, or None; and the ShowTVDBs.
+    Three queries.
+    """
+    show = Show.get_or_none(Show.id == show_id)
+    if show is None:
+        return None
+
+    turfs = OrderedDict((name, []) for name in PUBLIC_TURF_LOOKUP)
+    public = {v: k for k, v in PUBLIC_TURF_LOOKUP.items()}
+    my_state = None
+    for _, turf_modid, state, comments, modname in _turfs_with_mods([show_id]):
+        if state in public:
+            turfs[public[state]].append(ModInfo(modname, state, comments))
+        if turf_modid == modid:
+            my_state = MyInfo(state, comments)
+    for infos in turfs.values():
+        infos.sort(key=lambda info: info.modname.lower())
+
+    tvdbs = list(ShowTVDB.select().where(ShowTVDB.show == show_id))
+    return ShowPage(show, turfs, my_state, tvdbs)
@@ -1,25 +1,53 @@
 import datetime
 import itertools
+import json
 import logging
 import operator
 import re
 import time
 from urllib.parse import urlsplit, urlunsplit
 import warnings
-from collections import namedtuple
-
-from flask import jsonify, redirect, render_template, url_for
-from peewee import fn
+from collections import Counter, defaultdict, namedtuple
+
+from flask import Response, jsonify, redirect, render_template, url_for
+from humanize import naturaldelta
+from lxml import etree
+from peewee import (
+    BooleanField,
+    CompositeKey,
+    IntegerField,
+    chunked,
+    fn,
+    prefetch,
+)
 import redis_lock
 from tzlocal import get_localzone
 from unidecode import unidecode
 
 from ..base import app, celery, db, redis
 from ..auth import require_test
-from ..helpers import ensure_logged_in, get_browser, parse_dt, SITE_BASE
-from ..models import Meta, Show, Turf, TURF_STATES
+from ..crawl import CrawlCheckpoint, PageStore, SessionPool, crawl, describe_stats
+from ..helpers import (
+    describe_http_stats,
+    ensure_logged_in,
+    get_browser,
+    http_stats,
+    parse_dt,
+    SITE_BASE,
+)
+from ..models import BaseModel, Meta, Mod, Show, ShowTVDB, Turf, TURF_STATES
+from ..overview import touch_overview
+from ..parsing import (
+    has_class,
+    lxml_tree,
+    outer_html,
+    parser_backend,
+    string,
+    stripped_strings,
+    text,
+)
+from ..search import sync_search_index
 
-warnings.filterwarnings("ignore", "No parser was explicitly specified", UserWarning)
 warnings.filterwarnings(
     "ignore",
     message=r"Data truncated for column 'last_post' at row",
@@ -109,7 +137,10 @@ def is_locked(url, is_forum):
     br = get_browser()
     # ensure_logged_in(br)
     br.open(url)
+    return _is_locked(br, is_forum)
+
 
+def _is_locked(br, is_forum):
     if is_forum:
         return br.find("a", href=add_href) is None
     else:
@@ -120,10 +151,158 @@ def is_locked(url, is_forum):
             return div.find(text=locked_msg) is not None
 
 
-def get_site_show_list(categories=None, standalones=None):
-    "Get all of the SiteShow info from the forum letter pages."
+PROBE_KEY = "grab_shows_probe:{}"
+
+
+def probe(url, is_forum, probes=None):
+    """
+    What update_show_info needs to know about the page at url, to tell if a
+    show really converted between forum and thread: a dict with its HTTP
+    "status", and whether it's in a "vault" or "locked". Looks in probes
+    first, then in the cache, and only then at the site.
+    """
+    if probes and url in probes:
+        return probes[url]
+    cached = redis.get(PROBE_KEY.format(url))
+    if cached is not None:
+        return json.loads(cached)
+
     br = get_browser()
-    ensure_logged_in(br)
+    br.open(url)
+    ((_, result),), _ = _probe_page(br, url, is_forum)
+    _cache_probe(url, result)
+    return result
+
+
+def _probe_page(br, url, is_forum):
+    result = {"status": br.response.status_code, "vault": False, "locked": False}
+    if br.response.ok:
+        result["vault"] = any(
+            c.text.strip().endswith(" Vault")
+            for c in br.select('[data-role="breadcrumbList"] a')
+        )
+        result["locked"] = _is_locked(br, is_forum)
+    return [(url, result)], []
+
+
+def _cache_probe(url, result):
+    ttl = app.config.get("FORUM_PROBE_TTL", 24 * 60 * 60)
+    redis.setex(PROBE_KEY.format(url), ttl, json.dumps(result))
+
+
+def conversion_probes(site_shows, workers=None):
+    """
+    Probes (see probe) every page update_show_info will want to look at for
+    site_shows, concurrently, skipping ones that are cached. Returns a dict
+    of url => probe, to pass on to update_show_info.
+    """
+    targets = {}
+    for site_show in site_shows:
+        targets[site_show.url] = site_show.has_forum
+        for old in Show.select(Show.url, Show.has_forum).where(
+            Show.name == site_show.name,
+            Show.has_forum != site_show.has_forum,
+            Show.deleted_at.is_null(),
+        ):
+            targets[old.url] = old.has_forum
+    if not targets:
+        return {}
+
+    urls = list(targets)
+    probes = {
+        url: json.loads(cached)
+        for url, cached in zip(urls, redis.mget([PROBE_KEY.format(u) for u in urls]))
+        if cached is not None
+    }
+    jobs = [
+        (url, _probe_page, is_forum)
+        for url, is_forum in targets.items()
+        if url not in probes
+    ]
+    if jobs:
+        if workers is None:
+            workers = app.config.get("FORUM_CRAWL_WORKERS", 4)
+        sessions = SessionPool(workers, login=True)
+        for url, result in crawl(jobs, workers=workers, sessions=sessions):
+            _cache_probe(url, result)
+            probes[url] = result
+    return probes
+
+
+def might_have_converted(site_show):
+    """
+    Whether update_show_info would need to probe the site about site_show:
+    it's not in the db, but a live show with the same name is, as the other
+    of forum / thread.
+    """
+    key = (Show.forum_id == site_show.forum_id) & (
+        Show.has_forum == site_show.has_forum
+    )
+    if Show.select().where(key).exists():
+        return False
+    return (
+        Show.select()
+        .where(
+            Show.name == site_show.name,
+            Show.has_forum != site_show.has_forum,
+            Show.deleted_at.is_null(),
+        )
+        .exists()
+    )
+
+
+# the bits of listing pages that parse looks at; see crawl.PageStore
+LISTING_REGION = ", ".join(
+    [
+        ".ipsType_pageTitle",
+        ".cForumList",
+        ".cTopicList",
+        '[data-role="tablePagination"]',
+    ]
+)
+_listing_region_x = etree.XPath(
+    " | ".join(
+        [
+            "//*[{}]".format(has_class("ipsType_pageTitle")),
+            "//*[{}]".format(has_class("cForumList")),
+            "//*[{}]".format(has_class("cTopicList")),
+            '//*[@data-role="tablePagination"]',
+        ]
+    )
+)
+
+
+def _listing_region(br):
+    if parser_backend() == "lxml":
+        return [outer_html(el) for el in _listing_region_x(lxml_tree(br))]
+    return [str(el) for el in br.select(LISTING_REGION)]
+
+
+def listing_store():
+    "A PageStore for get_site_show_list, to skip pages that haven't changed."
+    return PageStore(
+        decode=SiteShow._make, region=_listing_region, prefix="grab_shows_page"
+    )
+
+
+def listing_checkpoint(before_save=None):
+    "A CrawlCheckpoint for get_site_show_list, so a failed grab can resume."
+    return CrawlCheckpoint("grab_shows_checkpoint", before_save=before_save)
+
+
+def get_site_show_list(
+    categories=None, standalones=None, workers=None, store=None, checkpoint=None
+):
+    """
+    Get all of the SiteShow info from the forum letter pages. Pages are
+    fetched concurrently (see crawl.crawl), so the order isn't stable.
+    With a store (see listing_store), unchanged pages give the same SiteShows
+    as last time without being parsed. With a checkpoint (see
+    listing_checkpoint), only the pages an unfinished crawl didn't get to
+    are fetched.
+    """
+    # update_show_info and is_locked use g.browser, and need it logged in
+    ensure_logged_in(get_browser())
 
     if categories is None:
         global all_categories
@@ -133,95 +312,228 @@ def get_site_show_list(categories=None, standalones=None):
         global standalone_forums
         standalones = standalone_forums
 
-    for page in standalones:
-        yield get_site_show(page)
-
-    page_queue = [(page, True) for page in categories]
-    while page_queue:
-        page, do_subfora = page_queue.pop()
-
-        br.open(page)
-        if not br.response.ok:
-            m = "HTTP code {} for {}"
-            raise IOError(m.format(br.response.status_code, page))
-
-        # do we have multiple pages?
-        a = br.parsed.select_one('[data-role="tablePagination"] a[rel="next"]')
-        if a and a.find_parent(class_="ipsPagination_inactive") is None:
-            page_queue.append((a["href"], False))
-
-        fora = br.select(".cForumList li[data-forumid]") if do_subfora else []
-        for li in fora:
-            if len(li.select(".cForumIcon_redirect")) > 0:
-                continue
-
-            forum_id = li["data-forumid"]
-            # sometimes there are "queued posts" links in here,
-            # but they're inside a <strong>.
-            a = li.select_one(".ipsDataItem_title > a:nth-of-type(1)")
-            name = str(a.string).strip()
-            url = str(a["href"])
-
-            if url in subcategory_pages:
-                continue
-
-            gone_forever = None  # not tracked anymore
-            is_tv = page not in non_show_pages
-
-            topics = 0  # doesn't seem to be available anymore
-            dts = li.select(".ipsDataItem_stats dt")
-            if len(dts) == 1:
-                posts = parse_number(dts[0].string)
-            elif len(dts) == 0:
-                posts = 0
-            else:
-                s = "{} stats entry for {} - {}"
-                raise ValueError(s.format(len(dts), name, page))
-
-            times = li.select("time")
-            if len(times) == 0:
-                last_post = None
-            elif len(times) == 1:
-                last_post = parse_dt(times[0]["datetime"])
-            else:
-                s = "{} time entries for {} - {}"
-                raise ValueError(s.format(len(times), name, page))
+    jobs = [(page, _standalone_page) for page in standalones]
+    jobs.extend((page, _listing_page, True) for page in categories)
+    return crawl(jobs, workers=workers, store=store, checkpoint=checkpoint)
+
+
+def _standalone_page(br, url):
+    return [parse_site_show(br, url)], []
+
 
-            yield SiteShow(
+def _listing_page(br, page, do_subfora):
+    "Parses a category page into SiteShows, plus a job for the next page."
+    if not br.response.ok:
+        m = "HTTP code {} for {}"
+        raise IOError(m.format(br.response.status_code, page))
+
+    parse = LISTING_PARSERS[parser_backend()]
+    shows, next_page = parse(br, page, do_subfora)
+    more = [(next_page, _listing_page, False)] if next_page else []
+    return shows, more
+
+
+def _listing_soup(br, page, do_subfora):
+    "Returns the SiteShows on a category page, and the next page's url."
+    shows = []
+    next_page = None
+
+    # do we have multiple pages?
+    a = br.parsed.select_one('[data-role="tablePagination"] a[rel="next"]')
+    if a and a.find_parent(class_="ipsPagination_inactive") is None:
+        next_page = a["href"]
+
+    fora = br.select(".cForumList li[data-forumid]") if do_subfora else []
+    for li in fora:
+        if len(li.select(".cForumIcon_redirect")) > 0:
+            continue
+
+        forum_id = li["data-forumid"]
+        # sometimes there are "queued posts" links in here,
+        # but they're inside a <strong>.
+        a = li.select_one(".ipsDataItem_title > a:nth-of-type(1)")
+        name = str(a.string).strip()
+        url = str(a["href"])
+
+        if url in subcategory_pages:
+            continue
+
+        gone_forever = None  # not tracked anymore
+        is_tv = page not in non_show_pages
+
+        topics = 0  # doesn't seem to be available anymore
+        dts = li.select(".ipsDataItem_stats dt")
+        if len(dts) == 1:
+            posts = parse_number(dts[0].string)
+        elif len(dts) == 0:
+            posts = 0
+        else:
+            s = "{} stats entry for {} - {}"
+            raise ValueError(s.format(len(dts), name, page))
+
+        times = li.select("time")
+        if len(times) == 0:
+            last_post = None
+        elif len(times) == 1:
+            last_post = parse_dt(times[0]["datetime"])
+        else:
+            s = "{} time entries for {} - {}"
+            raise ValueError(s.format(len(times), name, page))
+
+        shows.append(
+            SiteShow(
                 name, forum_id, True, url, topics, posts, last_post, gone_forever, is_tv
             )
+        )
 
-        for li in br.select(".cTopicList li[data-rowid]"):
-            if li.select('.ipsBadge[title^="Hidden"]'):
-                continue
-            # TODO: redirects here?
-
-            topic_id = li["data-rowid"]
-            (a,) = li.select(".ipsDataItem_title a[data-ipshover]")
-            (name,) = a.stripped_strings
-            name = str(name)
-
-            # drop query string from url
-            url = urlunsplit(urlsplit(a["href"])[:-2] + (None, None))
-
-            gone_forever = None  # leave as default
-            is_tv = page not in non_show_pages
-
-            topics = 0
-            (stats,) = li.select(".ipsDataItem_stats")
-            lis = stats.select("li")
-            assert len(lis) == 2
-            assert lis[0].select_one(".ipsDataItem_stats_type").text.strip() in {
-                "reply",
-                "replies",
-            }
-            posts = parse_number(lis[0].select(".ipsDataItem_stats_number")[0].string)
-
-            times = li.select(".ipsDataItem_lastPoster time")
-            assert len(times) == 1
-            last_post = parse_dt(times[0]["datetime"])
+    for li in br.select(".cTopicList li[data-rowid]"):
+        if li.select('.ipsBadge[title^="Hidden"]'):
+            continue
+        # TODO: redirects here?
+
+        topic_id = li["data-rowid"]
+        (a,) = li.select(".ipsDataItem_title a[data-ipshover]")
+        (name,) = a.stripped_strings
+        name = str(name)
+
+        # drop query string from url
+        url = urlunsplit(urlsplit(a["href"])[:-2] + (None, None))
+
+        gone_forever = None  # leave as default
+        is_tv = page not in non_show_pages
+
+        topics = 0
+        (stats,) = li.select(".ipsDataItem_stats")
+        lis = stats.select("li")
+        assert len(lis) == 2
+        assert lis[0].select_one(".ipsDataItem_stats_type").text.strip() in {
+            "reply",
+            "replies",
+        }
+        posts = parse_number(lis[0].select(".ipsDataItem_stats_number")[0].string)
+
+        times = li.select(".ipsDataItem_lastPoster time")
+        assert len(times) == 1
+        last_post = parse_dt(times[0]["datetime"])
+
+        shows.append(
+            SiteShow(
+                name,
+                topic_id,
+                False,
+                url,
+                topics,
+                posts,
+                last_post,
+                gone_forever,
+                is_tv,
+            )
+        )
+
+    return shows, next_page
+
+
+def _xpath(expr, *classes):
+    return etree.XPath(expr.format(*(has_class(c) for c in classes)))
+
+
+_next_page_x = _xpath('//*[@data-role="tablePagination"]//a[@rel="next"]')
+_inactive_x = _xpath("ancestor::*[{}]", "ipsPagination_inactive")
+_forum_lis_x = _xpath("//*[{}]//li[@data-forumid]", "cForumList")
+_redirect_x = _xpath(".//*[{}]", "cForumIcon_redirect")
+_forum_link_x = _xpath(".//*[{}]/a[1]", "ipsDataItem_title")
+_forum_stats_x = _xpath(".//*[{}]//dt", "ipsDataItem_stats")
+_time_x = _xpath(".//time")
+_topic_lis_x = _xpath("//*[{}]//li[@data-rowid]", "cTopicList")
+_hidden_x = _xpath('.//*[{}][starts-with(@title, "Hidden")]', "ipsBadge")
+_topic_link_x = _xpath(".//*[{}]//a[@data-ipshover]", "ipsDataItem_title")
+_topic_stats_x = _xpath(".//*[{}]", "ipsDataItem_stats")
+_li_x = _xpath(".//li")
+_stats_type_x = _xpath(".//*[{}]", "ipsDataItem_stats_type")
+_stats_number_x = _xpath(".//*[{}]", "ipsDataItem_stats_number")
+_last_poster_time_x = _xpath(".//*[{}]//time", "ipsDataItem_lastPoster")
+_page_title_x = _xpath("//*[{}]", "ipsType_pageTitle")
+
+
+def _listing_lxml(br, page, do_subfora):
+    "Same as _listing_soup, but with lxml."
+    tree = lxml_tree(br)
+    shows = []
+    next_page = None
+
+    # do we have multiple pages?
+    for a in _next_page_x(tree)[:1]:
+        if not _inactive_x(a):
+            next_page = a.get("href")
+
+    fora = _forum_lis_x(tree) if do_subfora else []
+    for li in fora:
+        if _redirect_x(li):
+            continue
+
+        forum_id = li.get("data-forumid")
+        a = _forum_link_x(li)[0]
+        name = str(string(a)).strip()
+        url = a.get("href")
+
+        if url in subcategory_pages:
+            continue
+
+        gone_forever = None
+        is_tv = page not in non_show_pages
+
+        topics = 0
+        dts = _forum_stats_x(li)
+        if len(dts) == 1:
+            posts = parse_number(string(dts[0]))
+        elif len(dts) == 0:
+            posts = 0
+        else:
+            s = "{} stats entry for {} - {}"
+            raise ValueError(s.format(len(dts), name, page))
+
+        times = _time_x(li)
+        if len(times) == 0:
+            last_post = None
+        elif len(times) == 1:
+            last_post = parse_dt(times[0].get("datetime"))
+        else:
+            s = "{} time entries for {} - {}"
+            raise ValueError(s.format(len(times), name, page))
+
+        shows.append(
+            SiteShow(
+                name, forum_id, True, url, topics, posts, last_post, gone_forever, is_tv
+            )
+        )
+
+    for li in _topic_lis_x(tree):
+        if _hidden_x(li):
+            continue
+
+        topic_id = li.get("data-rowid")
+        (a,) = _topic_link_x(li)
+        (name,) = stripped_strings(a)
 
-            yield SiteShow(
+        # drop query string from url
+        url = urlunsplit(urlsplit(a.get("href"))[:-2] + (None, None))
+
+        gone_forever = None
+        is_tv = page not in non_show_pages
+
+        topics = 0
+        (stats,) = _topic_stats_x(li)
+        lis = _li_x(stats)
+        assert len(lis) == 2
+        assert text(_stats_type_x(lis[0])[0]).strip() in {"reply", "replies"}
+        posts = parse_number(string(_stats_number_x(lis[0])[0]))
+
+        times = _last_poster_time_x(li)
+        assert len(times) == 1
+        last_post = parse_dt(times[0].get("datetime"))
+
+        shows.append(
+            SiteShow(
                 name,
                 topic_id,
                 False,
@@ -232,29 +544,44 @@ def get_site_show_list(categories=None, standalones=None):
                 gone_forever,
                 is_tv,
             )
+        )
+
+    return shows, next_page
+
+
+LISTING_PARSERS = {"soup": _listing_soup, "lxml": _listing_lxml}
 
 
 def get_site_show(url):
     "Get SiteShow info from a show page."
+    br = get_browser()
+    br.open(url)
+    return parse_site_show(br, url)
+
+
+def parse_site_show(br, url):
+    "Get SiteShow info from a show page that's already open in br."
     forum_match = forum_url_fmt.match(url)
     topic_match = topic_url_fmt.match(url)
 
     gone_forever = is_tv = None  # can't get these directly from the site page
     last_post = None  # haven't bothered implementing yet
 
-    br = get_browser()
-    br.open(url)
+    def page_title():
+        if parser_backend() == "lxml":
+            return text(_page_title_x(lxml_tree(br))[0]).strip()
+        return br.parsed.select_one(".ipsType_pageTitle").text.strip()
 
     if forum_match:
         has_forum = True
         forum_id = forum_match.group(1)
-        name = br.parsed.select_one(".ipsType_pageTitle").text.strip()
+        name = page_title()
         topics = posts = None  # annoying to get from forum page directly
 
     elif topic_match:
         has_forum = False
         forum_id = topic_match.group(1)
-        name = br.parsed.select_one(".ipsType_pageTitle").text.strip()
+        name = page_title()
         topics = 1
         posts = None  # annoying to get from thread directly now
     else:
@@ -265,7 +592,12 @@ def get_site_show(url):
     )
 
 
-def update_show_info(site_show):
+def update_show_info(site_show, probes=None):
+    """
+    Merges one SiteShow into the db. If it looks like the show converted
+    between forum and thread, this needs to look at the site (see probe),
+    unless probes (from conversion_probes) already has the answers.
+    """
     # find matching show
     with db.atomic():
         r = list(
@@ -289,20 +621,15 @@ def update_show_info(site_show):
                 old_alive = old.deleted_at is None
 
                 if old_alive:
-                    br = get_browser()
-                    br.open(old.url)
-                    old_alive = br.response.ok
+                    p = probe(old.url, old.has_forum, probes)
+                    old_alive = (
+                        p["status"] < 400 and not p["vault"] and not p["locked"]
+                    )
 
-                if old_alive and any(
-                    c.text.strip().endswith(" Vault")
-                    for c in br.select('[data-role="breadcrumbList"] a')
+                if (
+                    old_alive
+                    and probe(site_show.url, site_show.has_forum, probes)["locked"]
                 ):
-                    old_alive = False
-
-                if old_alive and is_locked(old.url, old.has_forum):
-                    old_alive = False
-
-                if old_alive and is_locked(site_show.url, site_show.has_forum):
                     # this is the forum for a locked show
                     return
 
@@ -422,6 +749,420 @@ def update_show_info(site_show):
             )
 
 
+class BulkMerge:
+    """
+    Does what update_show_info does for a whole crawl at once: every show is
+    loaded into memory up front, and then only the rows that are new or
+    actually changed get written, batch_size (default FORUM_MERGE_BATCH_SIZE)
+    at a time with insert_many / bulk_update. Forum <-> thread conversions
+    still go through update_show_info; ones that need to look at the site
+    (see might_have_converted) are best put off until probes for them all
+    are ready, and passed to add.
+    """
+
+    def __init__(self, batch_size=None):
+        if batch_size is None:
+            batch_size = app.config.get("FORUM_MERGE_BATCH_SIZE", 500)
+        self.batch_size = batch_size
+        self.stats = Counter()
+
+        self.by_key = defaultdict(list)
+        self.by_name = defaultdict(list)
+        for show in Show.select():
+            self._index(show)
+
+        self.statuses = defaultdict(set)
+        for show_id, status in ShowTVDB.select(
+            ShowTVDB.show, ShowTVDB.status
+        ).tuples():
+            if status:
+                self.statuses[show_id].add(status)
+
+        self.new = {}  # key => unsaved Show
+        self.dirty = {}  # id => (Show, set of changed fields)
+
+    @staticmethod
+    def _key(has_forum, forum_id):
+        return bool(has_forum), int(forum_id)
+
+    def _index(self, show):
+        self.by_key[self._key(show.has_forum, show.forum_id)].append(show)
+        self.by_name[show.name].append(show)
+
+    def _unindex(self, show_id):
+        for index in [self.by_key, self.by_name]:
+            for k, shows in list(index.items()):
+                shows[:] = [s for s in shows if s.id != show_id]
+                if not shows:
+                    del index[k]
+
+    def might_have_converted(self, site_show):
+        "Like might_have_converted, but without asking the db."
+        key = self._key(site_show.has_forum, site_show.forum_id)
+        if key in self.new or self.by_key.get(key):
+            return False
+        return any(
+            s.has_forum != site_show.has_forum and s.deleted_at is None
+            for s in self.by_name.get(site_show.name, [])
+        )
+
+    def add(self, site_show, probes=None):
+        key = self._key(site_show.has_forum, site_show.forum_id)
+
+        if key in self.new:  # listed twice; it's not in the db yet
+            self._update(self.new[key], site_show)
+            return
+
+        r = self.by_key.get(key)
+        if not r:
+            if any(
+                s.has_forum != site_show.has_forum
+                for s in self.by_name.get(site_show.name, [])
+            ):
+                self._convert(site_show, probes)
+            else:
+                self.new[key] = self._new_show(site_show)
+                logger.info("New show: {}".format(site_show.name))
+
+        elif len(r) == 1:
+            (db_show,) = r
+            old_name = db_show.name
+            changed = self._update(db_show, site_show)
+            if "name" in changed:
+                self.by_name[old_name].remove(db_show)
+                self.by_name[db_show.name].append(db_show)
+            if changed:
+                if db_show.id in self.dirty:
+                    self.dirty[db_show.id][1].update(changed)
+                else:
+                    self.dirty[db_show.id] = (db_show, changed)
+            else:
+                self.stats["unchanged"] += 1
+
+        else:
+            raise ValueError(
+                "{} entries for {} - {}".format(
+                    len(r), site_show.name, site_show.forum_id
+                )
+            )
+
+        if len(self.new) + len(self.dirty) >= self.batch_size:
+            self.flush()
+
+    def _convert(self, site_show, probes=None):
+        self.flush()
+        olds = [
+            s.id
+            for s in self.by_name[site_show.name]
+            if s.has_forum != site_show.has_forum
+        ]
+        db_show = update_show_info(site_show, probes)
+        for show_id in olds:
+            self._unindex(show_id)
+            self._index(Show.get_by_id(show_id))
+        if db_show is not None and db_show.id not in olds:
+            self._index(db_show)
+        self.stats["converted"] += 1
+
+    def _new_show(self, site_show):
+        def _maybe(x, default):
+            return default if x is None else x
+
+        if site_show.posts is not None and site_show.topics is not None:
+            needs_help = site_show.posts + site_show.topics > 100
+        else:
+            needs_help = False
+
+        return Show(
+            name=site_show.name,
+            forum_id=int(site_show.forum_id),
+            has_forum=site_show.has_forum,
+            url=site_show.url,
+            forum_posts=_maybe(site_show.posts, 0),
+            forum_topics=_maybe(site_show.topics, 0),
+            last_post=_maybe(site_show.last_post, datetime.datetime.today()),
+            needs_help=needs_help,
+            gone_forever=_maybe(site_show.gone_forever, False),
+            is_a_tv_show=_maybe(site_show.is_tv, True),
+        )
+
+    @staticmethod
+    def _set(show, name, value, changed):
+        # round-trip so e.g. '2020-01-01 00:00:00' matches the stored datetime
+        field = Show._meta.fields[name]
+        value = field.python_value(field.db_value(value))
+        if value != show.__data__.get(name):
+            setattr(show, name, value)
+            changed.add(name)
+
+    def _update(self, db_show, site_show):
+        "Applies site_show to db_show in memory; returns the changed fields."
+        changed = set()
+
+        if db_show.name != site_show.name:
+            if unidecode(db_show.name).lower() != unidecode(site_show.name).lower():
+                m = "Name disagreement: '{}' in db, renaming to '{}'."
+                logger.info(m.format(db_show.name, site_show.name))
+            self._set(db_show, "name", site_show.name, changed)
+
+        if db_show.url != site_show.url:
+            if db_show.id is not None:
+                m = "URL disagreement: '{}' in db, changing to '{}'."
+                logger.info(m.format(db_show.url, site_show.url))
+            self._set(db_show, "url", site_show.url, changed)
+
+        if site_show.posts is not None:
+            self._set(db_show, "forum_posts", site_show.posts, changed)
+        if site_show.topics is not None:
+            self._set(db_show, "forum_topics", site_show.topics, changed)
+        if site_show.last_post is not None:
+            self._set(db_show, "last_post", site_show.last_post, changed)
+        if site_show.gone_forever is not None:
+            self._set(db_show, "gone_forever", site_show.gone_forever, changed)
+        else:
+            # guess gone_forever based on TVDB
+            statuses = self.statuses.get(db_show.id, set())
+            if "Continuing" in statuses:
+                self._set(db_show, "gone_forever", False, changed)
+            elif statuses == {"Ended"}:
+                self._set(db_show, "gone_forever", True, changed)
+        if site_show.is_tv is not None:
+            if db_show.is_a_tv_show != site_show.is_tv:
+                m = "{}: we had as {}a tv show, site as {}one"
+                logger.info(
+                    m.format(
+                        site_show.name,
+                        "" if db_show.is_a_tv_show else "not ",
+                        "" if site_show.is_tv else "not ",
+                    )
+                )
+                self._set(db_show, "is_a_tv_show", site_show.is_tv, changed)
+        self._set(db_show, "deleted_at", None, changed)
+        return changed
+
+    def flush(self):
+        "Writes out everything pending."
+        if not self.new and not self.dirty:
+            return
+
+        by_fields = defaultdict(list)
+        for db_show, changed in self.dirty.values():
+            by_fields[frozenset(changed)].append(db_show)
+
+        with db.atomic():
+            if self.new:
+                Show.insert_many([s.__data__ for s in self.new.values()]).execute()
+            for changed, shows in by_fields.items():
+                Show.bulk_update(shows, fields=sorted(changed), batch_size=100)
+
+        # find out the new shows' ids, in case they turn up again
+        for has_forum in [True, False]:
+            ids = [f for h, f in self.new if h is has_forum]
+            if ids:
+                for show in Show.select().where(
+                    Show.has_forum == has_forum, Show.forum_id << ids
+                ):
+                    self._index(show)
+
+        self.stats["inserted"] += len(self.new)
+        self.stats["updated"] += len(self.dirty)
+        self.new = {}
+        self.dirty = {}
+
+
+class SeenShow(BaseModel):
+    "Temporary table of the shows a crawl saw, for remove_unseen_shows."
+    has_forum = BooleanField()
+    forum_id = IntegerField()
+
+    class Meta:
+        table_name = "seen_shows"
+        primary_key = CompositeKey("has_forum", "forum_id")
+
+
+def remove_unseen_shows(seen_forum_ids, update_time, batch_size=500):
+    """
+    Marks shows that weren't in seen_forum_ids (or hidden) as deleted, and
+    really deletes those that were already marked more than a day ago. The
+    seen ids go in a temporary table, so this is a handful of set-based
+    statements however many shows there are.
+    """
+    now = datetime.datetime.fromtimestamp(update_time)
+    thresh = now - datetime.timedelta(days=1)
+    fields = [SeenShow.has_forum, SeenShow.forum_id]
+
+    # the table is dropped outside the transaction: DROP TABLE commits it on MySQL
+    SeenShow.create_table(temporary=True)
+    try:
+        with db.atomic():
+            rows = sorted({(bool(h), int(f)) for h, f in seen_forum_ids})
+            for batch in chunked(rows, batch_size):
+                SeenShow.insert_many(batch, fields=fields).execute()
+            SeenShow.insert_from(
+                Show.select(Show.has_forum, Show.forum_id).where(Show.hidden), fields
+            ).on_conflict_ignore().execute()
+
+            # only look at forums / threads if we saw any at all, so a crawl
+            # that somehow missed one kind doesn't delete every show of it
+            kinds = [
+                h for (h,) in SeenShow.select(SeenShow.has_forum).distinct().tuples()
+            ]
+            if not kinds:
+                return
+            seen = SeenShow.select().where(
+                SeenShow.has_forum == Show.has_forum, SeenShow.forum_id == Show.forum_id
+            )
+            unseen = (Show.has_forum << kinds) & ~fn.EXISTS(seen)
+
+            n = (
+                Show.update(deleted_at=now)
+                .where(unseen, Show.deleted_at.is_null())
+                .execute()
+            )
+            if n:
+                logger.info("Marked {} unseen shows as deleted".format(n))
+
+            doomed = list(
+                prefetch(
+                    Show.select(Show.id, Show.name).where(
+                        unseen, Show.deleted_at < thresh
+                    ),
+                    Turf.select(Turf.show, Turf.state, Mod.name)
+                    .join(Mod)
+                    .order_by(Turf.state, Mod.name),
+                    ShowTVDB.select(ShowTVDB.show, ShowTVDB.tvdb_id),
+                )
+            )
+    finally:
+        SeenShow.drop_table(safe=True)
+
+    get_state = operator.attrgetter("state")
+    for s in doomed:
+        mod_info = []
+        bits = {
+            k: ", ".join(t.mod.name for t in v)
+            for k, v in itertools.groupby(s.turf_set, key=get_state)
+        }
+        for k, n in TURF_STATES.items():
+            if k in bits:
+                mod_info.append("{}: {}".format(n, bits[k]))
+        if not mod_info:
+            mod_info.append("no mods")
+        tvdb_info = ", ".join(str(st.tvdb_id) for st in s.tvdb_ids)
+        logger.info(
+            "Deleting {} ({}) ({})".format(s.name, "; ".join(mod_info), tvdb_info)
+        )
+
+    for batch in chunked([s.id for s in doomed], batch_size):
+        with db.atomic():
+            Show.delete().where(Show.id << batch).execute()
+
+
+TOTAL_KEY = "grab_shows_last_total"
+
+
+def progress_channel(task_id):
+    return "grab_shows_progress:{}".format(task_id)
+
+
+def progress_status(meta):
+    "Describes a PROGRESS state's meta for people."
+    if meta.get("step") == "main":
+        msg = "Processing show {:,}".format(meta["current"])
+        if meta.get("total"):
+            msg += " of about {:,}".format(max(meta["total"], meta["current"]))
+        if meta.get("rate"):
+            msg += " ({:,.1f}/sec".format(meta["rate"])
+            if meta.get("eta") is not None:
+                msg += ", about {} left".format(naturaldelta(meta["eta"]))
+            msg += ")"
+        return msg
+    elif meta.get("step") == "probes":
+        return "Checking possible forum / thread conversions"
+    elif meta.get("step") == "wrapup":
+        return "Wrapping up"
+    else:
+        return str(meta)  # not sure what happened here...
+
+
+class ThrottledProgress:
+    """
+    Passes on merge progress at most once per `every` shows or `interval`
+    seconds (GRAB_PROGRESS_EVERY and GRAB_PROGRESS_INTERVAL), whichever comes
+    first, with the rate and an ETA against the size of the last crawl. Each
+    update goes to the celery task state and is published on the task's redis
+    channel, for progress_events.
+    """
+
+    def __init__(self, task, every=None, interval=None):
+        self.task = task
+        self.task_id = task.request.id
+        if every is None:
+            every = app.config.get("GRAB_PROGRESS_EVERY", 250)
+        if interval is None:
+            interval = app.config.get("GRAB_PROGRESS_INTERVAL", 2)
+        self.every = every
+        self.interval = interval
+
+        total = redis.get(TOTAL_KEY)
+        if total is None:
+            total = Show.select().where(Show.deleted_at.is_null()).count()
+        self.total = int(total)
+
+        self.start = self.last_time = time.time()
+        self.step = None
+        self.current = self.last_current = 0
+        self.rate = None
+
+    def __call__(self, step, current=None):
+        now = time.time()
+        if current is not None:
+            self.current = current
+        if step == self.step:
+            if (
+                self.current - self.last_current < self.every
+                and now - self.last_time < self.interval
+            ):
+                return
+            # smooth the rate out a bit, but let it follow changes
+            rate = (self.current - self.last_current) / max(now - self.last_time, 1e-6)
+            self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+        self.step = step
+        self.last_time = now
+        self.last_current = self.current
+
+        meta = {"step": step, "current": self.current, "total": self.total}
+        if self.rate and step == "main":
+            meta["rate"] = self.rate
+            meta["eta"] = max(self.total - self.current, 0) / self.rate
+        meta["elapsed"] = now - self.start
+        self.send("PROGRESS", meta, progress_status(meta))
+
+    def send(self, state, meta, status):
+        if self.task_id is None:
+            # celery crashes on self.update_state when task_id is None
+            # ("expected a bytes-like object, NoneType found")
+            return
+        if state == "PROGRESS":
+            self.task.update_state(state=state, meta=meta)
+        msg = dict(meta, state=state, status=status)
+        redis.publish(progress_channel(self.task_id), json.dumps(msg))
+
+    def finish(self, result):
+        redis.set(TOTAL_KEY, self.current)
+        self.send("SUCCESS", {}, done_status(result))
+
+    def fail(self, exc):
+        self.send("FAILURE", {}, "ERROR: {}".format(exc))
+
+
+def done_status(result):
+    status = "Done!"
+    if isinstance(result, dict) and result.get("crawl"):
+        status += " " + describe_stats(result["crawl"])
+    return status
+
+
 @celery.task(bind=True)
 def merge_shows_list(self, **kwargs):
     lock = redis_lock.Lock(redis, "lock_grab_shows", expire=600, auto_renewal=True)
@@ -430,21 +1171,19 @@ def merge_shows_list(self, **kwargs):
 
     try:
         if self.request.id is None:
-            # celery crashes on self.update_state when task_id is None
-            # ("expected a bytes-like object, NoneType found")
-            def progress(**meta):
-                pass
-
             redis.set("grab_shows_taskid", "NOT IN CELERY")
         else:
-
-            def progress(**meta):
-                self.update_state(state="PROGRESS", meta=meta)
-
             redis.set("grab_shows_taskid", self.request.id.encode())
+        progress = ThrottledProgress(self)
 
         try:
-            _do_merge_shows_list(self, progress=progress, **kwargs)
+            result = _do_merge_shows_list(self, progress=progress, **kwargs)
+        except Exception as e:
+            progress.fail(e)
+            raise
+        else:
+            progress.finish(result)
+            return result
         finally:
             redis.delete("grab_shows_taskid")
     finally:
@@ -472,57 +1211,82 @@ def start_or_join_merge_shows_list(**kwargs):
         return merge_shows_list.apply_async(kwargs=kwargs)
 
 
-def _do_merge_shows_list(self, progress, **kwargs):
-    update_time = time.time()
-    seen_forum_ids = {
-        (s.has_forum, s.forum_id)
-        for s in Show.select(Show.has_forum, Show.forum_id).where(Show.hidden)
-    }
+def _do_merge_shows_list(
+    self, progress, bulk=True, incremental=None, resume=None, **kwargs
+):
+    if incremental is None:
+        incremental = app.config.get("FORUM_CRAWL_INCREMENTAL", True)
+    if resume is None:
+        resume = app.config.get("FORUM_CRAWL_RESUME", True)
+    store = listing_store() if incremental else None
+    merge = BulkMerge() if bulk else None
+    http_before = http_stats.snapshot()
+
+    checkpoint = listing_checkpoint(merge.flush if merge is not None else None)
+    if not resume:
+        checkpoint.clear()
+    show_list = get_site_show_list(store=store, checkpoint=checkpoint, **kwargs)
+
+    # pages from an earlier, unfinished run are already in the database
+    for site_show in show_list:
+        checkpoint.see((site_show.has_forum, site_show.forum_id))
+        progress(step="main", current=len(checkpoint.seen))
+        if merge is not None:
+            if merge.might_have_converted(site_show):
+                checkpoint.defer(site_show)
+            else:
+                merge.add(site_show)
+        elif might_have_converted(site_show):
+            checkpoint.defer(site_show)
+        else:
+            update_show_info(site_show)
+    if checkpoint.resumed:
+        logger.info(
+            "Resumed a crawl started at {}".format(
+                datetime.datetime.fromtimestamp(checkpoint.started)
+            )
+        )
 
-    for i, site_show in enumerate(get_site_show_list(**kwargs)):
-        progress(step="main", current=i)
-        seen_forum_ids.add((site_show.has_forum, site_show.forum_id))
-        update_show_info(site_show)
+    # forum / thread conversions that need to look at the site, all at once
+    if checkpoint.deferred:
+        progress(step="probes")
+        deferred = sorted(
+            map(SiteShow._make, checkpoint.deferred), key=operator.attrgetter("url")
+        )
+        probes = conversion_probes(deferred, workers=kwargs.get("workers"))
+        for site_show in deferred:
+            if merge is not None:
+                merge.add(site_show, probes)
+            else:
+                update_show_info(site_show, probes)
 
-    progress(step="wrapup")
-    # mark unseen shows as deleted
-    unseen = []
-    for has_forum in [True, False]:
-        seen_ids = [forum_id for h, forum_id in seen_forum_ids if h is has_forum]
-        if seen_ids:
-            unseen.extend(
-                Show.select().where(
-                    ~(Show.forum_id << seen_ids), Show.has_forum == has_forum
-                )
-            )
+    if merge is not None:
+        merge.flush()
+        logger.info(
+            "Show merge: "
+            + ", ".join("{} {}".format(v, k) for k, v in sorted(merge.stats.items()))
+        )
+    if store is not None:
+        logger.info("Crawl: " + describe_stats(store.stats))
+    http = http_stats.snapshot() - http_before
+    logger.info("Forum HTTP: " + describe_http_stats(http))
 
-    now = datetime.datetime.fromtimestamp(update_time)
-    thresh = datetime.timedelta(days=1)
-    get_state = operator.attrgetter("state")
-    for s in unseen:
-        if s.deleted_at is None:
-            s.deleted_at = now
-            s.save()
-        elif (now - s.deleted_at) > thresh:
-            mod_info = []
-            bits = {
-                k: ", ".join(t.mod.name for t in v)
-                for k, v in itertools.groupby(
-                    s.turf_set.order_by(Turf.state), key=get_state
-                )
-            }
-            for k, n in TURF_STATES.items():
-                if k in bits:
-                    mod_info.append("{}: {}".format(n, bits[k]))
-            if not mod_info:
-                mod_info.append("no mods")
-            tvdb_info = ", ".join(str(st.tvdb_id) for st in s.tvdb_ids)
-            logger.info(
-                "Deleting {} ({}) ({})".format(s.name, "; ".join(mod_info), tvdb_info)
-            )
-            s.delete_instance()
+    # only get here once the whole crawl has finished; if the wrap-up fails,
+    # the next run goes straight back to it
+    progress(step="wrapup")
+    update_time = checkpoint.started
+    remove_unseen_shows(checkpoint.seen, update_time)
 
     Meta.set_value("forum_update_time", update_time)
+    touch_overview()
+    sync_search_index()
+    checkpoint.clear()
+    return {
+        "crawl": dict(store.stats) if store is not None else None,
+        "merge": dict(merge.stats) if merge is not None else None,
+        "http": dict(http),
+        "resumed": checkpoint.resumed,
+    }
 
 
 @app.route("/grab-shows/start/", methods=["POST"])
@@ -531,6 +1295,7 @@ def grab_start():
     task = start_or_join_merge_shows_list()
     body = {
         "pathname": url_for("grab_control", task_id=task.id),
+        "task_id": task.id,
     }
     headers = {
         "Location": url_for("grab_status", task_id=task.id),
@@ -545,26 +1310,56 @@ def get_status_info(task):
     elif task.state == "PENDING":
         resp["status"] = "Pending..."
     elif task.state == "SUCCESS":
-        resp["status"] = "Done!"
+        resp["status"] = done_status(task.result)
     else:
         resp.update(task.info)
-        if task.info.get("step") == "main":
-            resp["status"] = "Processing show {:,} of about {:,}".format(
-                task.info["current"], Show.select(fn.COUNT("*")).scalar()
-            )
-        elif task.info.get("step") == "wrapup":
-            resp["status"] = "Wrapping up"
-        else:
-            resp["status"] = str(task.info)  # not sure what happened here...
+        resp["status"] = progress_status(task.info)
     return resp
 
 
+def progress_events(task_id, timeout=15):
+    """
+    Yields get_status_info-style dicts for a merge task as it goes, until it
+    finishes: first the current state, then whatever the task publishes. If
+    nothing comes for `timeout` seconds, checks the task's state directly,
+    in case we missed the end somehow.
+    """
+    task = merge_shows_list.AsyncResult(task_id)
+    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(progress_channel(task_id))
+    try:
+        # subscribe first, so nothing can happen between this and listening
+        info = get_status_info(task)
+        yield info
+        while info["state"] not in {"SUCCESS", "FAILURE", "REVOKED"}:
+            msg = pubsub.get_message(timeout=timeout)
+            if msg is None:
+                info = get_status_info(task)
+            else:
+                info = json.loads(msg["data"])
+            yield info
+    finally:
+        pubsub.close()
+
+
 @app.route("/grab-shows/status/<task_id>/")
 def grab_status(task_id):
     task = merge_shows_list.AsyncResult(task_id)
     return jsonify(get_status_info(task))
 
 
+@app.route("/grab-shows/events/<task_id>/")
+def grab_events(task_id):
+    "Server-sent events with the task's progress."
+
+    def stream():
+        for info in progress_events(task_id):
+            yield "data: {}\n\n".format(json.dumps(info))
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream(), mimetype="text/event-stream", headers=headers)
+
+
 @app.route("/grab-shows/")
 @app.route("/grab-shows/going/<task_id>/")
 def grab_control(task_id=None):
@@ -590,6 +1385,24 @@ def main():
     import argparse
 
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--one-by-one",
+        dest="bulk",
+        action="store_false",
+        help="merge each show in its own transaction, as update_show_info does",
+    )
+    parser.add_argument(
+        "--full",
+        dest="incremental",
+        action="store_false",
+        help="parse every page, even ones that haven't changed since last time",
+    )
+    parser.add_argument(
+        "--restart",
+        dest="resume",
+        action="store_false",
+        help="start the crawl over, even if the last one didn't finish",
+    )
     args = parser.parse_args()
 
     with app.app_context():
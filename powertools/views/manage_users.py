@@ -5,6 +5,7 @@ from peewee import fn, SQL
 from ..auth import require_test
 from ..base import app
 from ..models import Mod, Show, Turf, TURF_LOOKUP
+from ..overview import touch_overview
 
 
 @app.route("/user/manage/")
@@ -38,6 +39,7 @@ def delete_user(modid):
     else:
         flash(f"Okay, {mod.name} is gone forever.")
         mod.delete_instance()
+        touch_overview()
         return redirect(url_for("manage_users"))
 
 
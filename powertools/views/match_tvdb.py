@@ -11,6 +11,8 @@ from peewee import JOIN, fn
 
 from ..base import app, db
 from ..models import Show, ShowTVDB
+from ..overview import touch_overview
+from ..search import sync_search_index
 from ..tvdb import fill_show_meta, get, get_show_info, update_series
 
 
@@ -106,6 +108,8 @@ def add_tvdb(show_id):
 
         show.tvdb_not_matched_yet = False
         show.save()
+    touch_overview([show.id])
+    sync_search_index([show.id])
 
     update_series.delay(tvdb_id).forget()
     return redirect(target)
@@ -122,6 +126,8 @@ def delete_tvdb(show_id, tvdb_id):
         abort(404)
 
     tvdb.delete_instance()
+    touch_overview([show_id])
+    sync_search_index([show_id])
 
     flash("Removed TVDB '{}' ({})".format(tvdb.name, tvdb_id))
     return redirect(url_for('edit_tvdb', show_id=show_id))
@@ -284,6 +290,9 @@ def match_tvdb_execute():
             except Exception:
                 errors.append((show, None, traceback.format_exc()))
 
+    touch_overview([show_id for show_id, _ in changes] + non_shows)
+    sync_search_index([show_id for show_id, _ in changes])
+
     if errors:
         resp = render_template('match_tvdb_execute.html', errors=errors)
         return Response(resp, status=500)
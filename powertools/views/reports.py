@@ -2,21 +2,23 @@ import datetime
 import re
 import traceback
 from urllib.parse import urlsplit, urlunsplit
-import warnings
 
 from flask import Response, url_for
+from lxml import etree
 import redis_lock
 
 from ..base import app, celery, redis
 from ..helpers import SITE_BASE, get_browser, open_with_login, require_local
 from ..models import Mod, Report, Show, TURF_LOOKUP, Turf
+from ..overview import touch_overview
+from ..parsing import lxml_tree, parser_backend, text
+from ..search import sync_search_index
 from .grab_shows import get_site_show, subcategory_pages, update_show_info
 
 
 REPORT_URL = re.compile(r'/modcp/reports/(\d+)/?$')
-
-warnings.filterwarnings(
-    'ignore', "No parser was explicitly specified", UserWarning)
+_report_links = etree.XPath(
+    '//h4//a[starts-with(@href, "{}/modcp/reports/")]'.format(SITE_BASE))
 
 
 def get_reports():
@@ -24,11 +26,17 @@ def get_reports():
 
     # only gets from the first page, for now
     open_with_login(br, '{}/modcp/reports/'.format(SITE_BASE))
+    if parser_backend() == 'lxml':
+        links = [(text(a), a.get('href')) for a in _report_links(lxml_tree(br))]
+    else:
+        links = [(a.text, a.attrs['href']) for a in br.select(
+            'h4 a[href^="{}/modcp/reports/"]'.format(SITE_BASE))]
+
     resp = []
-    for a in br.select('h4 a[href^="{}/modcp/reports/"]'.format(SITE_BASE)):
-        tgt = urlsplit(a.attrs['href']).path
+    for name, href in links:
+        tgt = urlsplit(href).path
         report_id = int(REPORT_URL.match(tgt).group(1))
-        resp.append((a.text.strip(), report_id))
+        resp.append((name.strip(), report_id))
     return resp
 
 
@@ -62,7 +70,11 @@ def report_forum(report_id, check_if_deleted=False):
     for a in reversed(crumbs):
         # if we hit Other Dramas/etc, then this must be a new thread
         if a['href'] in subcategory_pages:
-            return update_show_info(get_site_show(base_url))
+            show = update_show_info(get_site_show(base_url))
+            if show is not None:  # None if it was a locked show's conversion
+                touch_overview([show.id])
+                sync_search_index([show.id])
+            return show
 
         try:
             return Show.get(Show.url == a['href'], Show.deleted_at.is_null(True))
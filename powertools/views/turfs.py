@@ -1,6 +1,10 @@
+import base64
+import binascii
 import datetime
-from collections import namedtuple
-from itertools import groupby
+import gzip
+from itertools import islice
+import json
+import pickle
 import re
 
 from flask import (
@@ -14,36 +18,52 @@ from flask import (
     url_for,
 )
 from flask_login import current_user, login_required
-from peewee import IntegrityError, NodeList, SQL, fn, prefetch
+from peewee import (
+    Case,
+    IntegrityError,
+    JOIN,
+    MySQLDatabase,
+    NodeList,
+    PostgresqlDatabase,
+    SQL,
+    fn,
+)
 
-from ..base import app
-from ..helpers import parse_bool, strip_the
+from ..base import app, redis
+from ..helpers import parse_bool
 from ..models import (
     Mod,
     Show,
-    ShowTVDB,
     Turf,
     TURF_LOOKUP,
     TURF_STATES,
-    TURF_ORDER,
-    PUBLIC_TURF_LOOKUP,
+)
+from ..overview import data_version, first_letter, get_overview, touch_overview
+from ..search import SOURCES, search_shows
+from ..viewmodels import (
+    NO_INFO,
+    load_show_page,
+    load_show_rows,
+    sort_key,
+    with_my_info,
 )
 
 
 @app.route("/show/<int:show_id>/")
 @login_required
 def show(show_id):
-    try:
-        show = Show.get(Show.id == show_id)
-    except Show.DoesNotExist:
+    modid = current_user.id if current_user.is_authenticated else None
+    page = load_show_page(show_id, modid)
+    if page is None:
         abort(404)
 
     return render_template(
         "show.html",
-        show=show,
-        Turf=Turf,
+        show=page.show,
+        turfs=page.turfs,
+        my_state=page.my_state,
+        tvdbs=page.tvdbs,
         TURF_LOOKUP=TURF_LOOKUP,
-        PUBLIC_TURF_LOOKUP=PUBLIC_TURF_LOOKUP,
     )
 
 
@@ -77,6 +97,7 @@ def show_edit_turf(show_id):
                 turf.state = val
                 turf.comments = comments
                 turf.save()
+    touch_overview([show.id])
 
     return redirect(url_for("show", show_id=show_id))
 
@@ -89,6 +110,7 @@ def show_edit_needs_help(show_id):
     val = request.form.get("needs-help", "off") == "on"
 
     r = Show.update(needs_help=val).where(Show.id == show_id).execute()
+    touch_overview([show_id])
     if r in {0, 1}:
         return redirect(url_for("show", show_id=show_id))
     else:
@@ -108,101 +130,158 @@ def show_redirect(forums_id, rest=None):
 
 @app.route("/search/")
 def show_search():
-    q = request.args.get("q")
-    matches = (
-        Show.select()
-        .where(Show.name ** "%{}%".format(q))
-        .where(Show.deleted_at.is_null(True))
-        .order_by(Show.name)
-    )
-    if len(matches) == 1:
+    q = request.args.get("q", "")
+    matches = search_shows(q)
+    if len(matches) == 1 and matches[0].exact:
         return redirect(url_for("show", show_id=matches[0].id))
-    return render_template("search.html", query=q, matches=matches)
+    return render_template("search.html", query=q, matches=matches, SOURCES=SOURCES)
 
 
-################################################################################
-### Main turfs page
+@app.route("/search/typeahead/")
+def show_typeahead():
+    "JSON suggestions for a partly-typed show name: no near misses."
+    limit = min(request.args.get("limit", 10, type=int), 50)
+    hits = search_shows(request.args.get("q", ""), limit=limit, fuzzy=False)
+    return jsonify(
+        results=[
+            {
+                "id": hit.id,
+                "name": hit.name,
+                "matched": None if hit.source == "n" else hit.text,
+                "url": url_for("show", show_id=hit.id),
+            }
+            for hit in hits
+        ]
+    )
 
-ModInfo = namedtuple("ModInfo", ["modname", "state", "comments"])
-MyInfo = namedtuple("MyInfo", ["state", "comments"])
 
+################################################################################
+### Main turfs page
 
 @app.route("/turfs/")
 @login_required
 def mod_turfs():
-    if hasattr(current_user, "id"):
-        modid = int(current_user.id)
-    else:
-        modid = None
-    one_year_ago = datetime.datetime.now() - datetime.timedelta(days=365)
-
-    turfs_with_stuff = prefetch(
-        Turf.select(), Show.select(), Mod.select(), ShowTVDB.select()
+    overview = get_overview()
+    return render_template(
+        "mod_turfs.html",
+        hi_post_thresh=overview.hi_post_thresh,
+        firsts=overview.firsts,
+        page_size=app.config.get("TURFS_PAGE_SIZE", 100),
+        TURF_LOOKUP=TURF_LOOKUP,
     )
 
-    show_info = {
-        s.id: (
-            s,
-            {
-                "n_mods": 0,
-                "mod_info": [],
-                "my_info": MyInfo(None, None),
-                "in_last_year": (
-                    s.last_post is not None and s.last_post >= one_year_ago
-                ),
-            },
-        )
-        for s in Show.select().where(~Show.hidden).where(Show.deleted_at.is_null(True))
-    }
-
-    turfs_that_count = {TURF_LOOKUP["lead"], TURF_LOOKUP["backup"]}
 
-    for turf in turfs_with_stuff:
-        show = turf.show
-        if show.hidden or show.deleted_at is not None:
-            continue
-        _, show_inf = show_info[show.id]
+def _encode_cursor(row):
+    key = json.dumps(sort_key(row)).encode()
+    return base64.urlsafe_b64encode(key).decode()
 
-        if turf.modid == modid:
-            show_inf["my_info"] = MyInfo(turf.state, turf.comments)
 
-        show_inf["mod_info"].append(ModInfo(turf.mod.name, turf.state, turf.comments))
+def _decode_cursor(cursor):
+    "The sort_key a cursor points after; raises ValueError if it's garbage."
+    try:
+        name, showid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, binascii.Error, UnicodeError):
+        raise ValueError("bad cursor {!r}".format(cursor))
+    if not isinstance(name, str) or not isinstance(showid, int):
+        raise ValueError("bad cursor {!r}".format(cursor))
+    return name, showid
+
+
+def _row_tests(args, mine, now):
+    """
+    Functions of (ShowRow, info) for each filter in args that has to pass.
+    Raises ValueError for filters that don't make sense.
+    """
+    tests = []
+
+    letter = args.get("letter")
+    if letter:
+        tests.append(lambda row, info: first_letter(row) == letter.lower())
+
+    my_state = args.get("mine")
+    if my_state == "any":
+        tests.append(lambda row, info: row.id in mine)
+    elif my_state:
+        if my_state not in TURF_STATES:
+            raise ValueError("unknown turf state {!r}".format(my_state))
+        tests.append(lambda row, info: mine.get(row.id, NO_INFO).state == my_state)
+
+    kind = args.get("kind")
+    if kind == "forum":
+        tests.append(lambda row, info: row.has_forum)
+    elif kind == "thread":
+        tests.append(lambda row, info: not row.has_forum)
+    elif kind:
+        raise ValueError("unknown kind {!r}".format(kind))
+
+    flags = {
+        "no_mods": lambda row, info: info["n_mods"] == 0,
+        "needs_help": lambda row, info: row.needs_help,
+        "no_tvdb": lambda row, info: row.is_a_tv_show and not row.tvdb_ids,
+        "in_last_year": lambda row, info: (
+            row.last_post is not None
+            and row.last_post >= now - datetime.timedelta(days=365)
+        ),
+    }
+    for name, test in flags.items():
+        if parse_bool(args.get(name, "false")):
+            tests.append(test)
 
-        if turf.state in turfs_that_count:
-            show_inf["n_mods"] += 1
+    q = args.get("q", "").strip().lower()
+    if q:
+        tests.append(lambda row, info: q in row.name.lower())
 
-    def get_name(show_and_info):
-        return strip_the(show_and_info[0].name).lower()
+    return tests
 
-    show_info = sorted(show_info.values(), key=get_name)
-    for show_id, info in show_info:
-        info["mod_info"] = sorted(
-            info["mod_info"],
-            key=lambda info: (TURF_ORDER.find(info.state), info.modname.lower()),
-        )
 
-    niceify = lambda c: c if c.isalpha() else "#"
-    firsts = [
-        (letter, next(iter(letter_show_infos))[0].id)
-        for letter, letter_show_infos in groupby(
-            show_info, key=lambda s: niceify(get_name(s)[0])
-        )
-    ]
-
-    n_postses = sorted(
-        show.n_posts() for show, info in show_info if show.n_posts() != "n/a"
-    )
-    hi_post_thresh = n_postses[int(len(n_postses) * 0.9)]
+@app.route("/turfs/rows/")
+@login_required
+def turf_rows():
+    """
+    The rows of the turfs table that pass the filters in the query string
+    (see _row_tests), in name order, a page at a time. Gives JSON with the
+    rendered rows, their show ids, and the cursor to pass to get the next
+    page (null at the end); the first page also has the total count.
+    """
+    modid = current_user.id
+    now = datetime.datetime.now()
+    max_size = app.config.get("TURFS_MAX_PAGE_SIZE", 500)
+    size = request.args.get("limit", app.config.get("TURFS_PAGE_SIZE", 100), type=int)
+    size = max(1, min(size, max_size))
+
+    overview = get_overview()
+    mine = overview.by_mod.get(modid, {})
+    cursor = request.args.get("cursor")
+    try:
+        tests = _row_tests(request.args, mine, now)
+        after = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return abort(400)
 
-    return render_template(
-        "mod_turfs.html",
-        shows=show_info,
-        mods=Mod.select(),
-        hi_post_thresh=hi_post_thresh,
-        now=datetime.datetime.now(),
-        firsts=firsts,
-        TURF_LOOKUP=TURF_LOOKUP,
+    matches = (
+        (row, info)
+        for row, info in overview.rows_after(after)
+        if all(test(row, info) for test in tests)
     )
+    page = list(islice(matches, size + 1))
+    if cursor is None:
+        total = len(page) + sum(1 for _ in matches)
+    next_cursor = _encode_cursor(page[size - 1][0]) if len(page) > size else None
+    page = with_my_info(page[:size], mine, now=now)
+
+    result = {
+        "html": render_template(
+            "turf_rows.html",
+            shows=page,
+            hi_post_thresh=overview.hi_post_thresh,
+            TURF_LOOKUP=TURF_LOOKUP,
+        ),
+        "ids": [row.id for row, _ in page],
+        "next": next_cursor,
+    }
+    if cursor is None:
+        result["total"] = total
+    return jsonify(result)
 
 
 @login_required
@@ -219,10 +298,10 @@ def update_show(attr, bool_val=False):
             show = Show.get(id=showid)
             setattr(show, attr, val)
             show.save(only=[getattr(Show, attr)])
-
-            return jsonify(curr=val)
     except Show.DoesNotExist:
         return abort(404)
+    touch_overview([showid])
+    return jsonify(curr=val)
 
 
 @app.route("/_mark_needs_help/", methods=["POST"])
@@ -266,29 +345,14 @@ def _mark_territory():
                 turf.state = val
                 turf.comments = comments
                 turf.save()
+    touch_overview([show.id])
 
-    year_ago = datetime.datetime.now() - datetime.timedelta(days=365)
-    info = {
-        "my_info": [val, comments],
-        "n_posts": show.n_posts(),
-        "in_last_year": (show.last_post is not None and show.last_post >= year_ago),
-    }
-    info["mod_info"] = sorted(
-        (
-            ModInfo(turf.mod.name, turf.state, turf.comments)
-            for turf in Show.get(id=showid).turf_set
-        ),
-        key=lambda modinf: (-"nwcg".find(modinf.state), modinf.modname.lower()),
-    )
-    info["n_mods"] = sum(
-        1
-        for modinf in info["mod_info"]
-        if modinf.state in {TURF_LOOKUP["lead"], TURF_LOOKUP["backup"]}
-    )
+    rows, by_mod = load_show_rows([showid], visible_only=False)
+    ((row, info),) = with_my_info(rows, by_mod.get(modid, {}))
 
     return render_template(
         "turf_row.html",
-        show=show,
+        show=row,
         info=info,
         modid=modid,
         modname=modname,
@@ -301,82 +365,178 @@ def _mark_territory():
 ################################################################################
 ### Turfs CSV dump
 
-turfs_query = (
-    Show.select(
-        Show,
-        Turf.select(fn.count(SQL("*")))
-        .where((Turf.state == TURF_LOOKUP["lead"]) & (Turf.show == Show.id))
-        .alias("leadcount"),
-        Turf.select(fn.count(SQL("*")))
-        .where((Turf.state == TURF_LOOKUP["backup"]) & (Turf.show == Show.id))
-        .alias("helpercount"),
-        Turf.select(fn.group_concat(NodeList((Mod.name, SQL("SEPARATOR ', '")))))
-        .join(Mod)
-        .where((Turf.show == Show.id) & (Turf.state == TURF_LOOKUP["lead"]))
-        .alias("leads"),
-        Turf.select(fn.group_concat(NodeList((Mod.name, SQL("SEPARATOR ', '")))))
-        .join(Mod)
-        .where((Turf.show == Show.id) & (Turf.state == TURF_LOOKUP["backup"]))
-        .alias("backups"),
-        Turf.select(fn.group_concat(NodeList((Mod.name, SQL("SEPARATOR ', '")))))
+CSV_ROWS_KEY = "turfs_csv_rows:{}"
+CSV_FULL_KEY = "turfs_csv_gz:{}"
+
+CSV_HEADER = (
+    "name,posts,last_post,gone_forever,has_forum,"
+    "leadcount,helpercount,leads,backups,couldhelps,needs_help\n"
+)
+
+
+def _string_agg(expr, sep):
+    "An aggregate joining the non-null values of expr with sep, in any dialect."
+    if isinstance(g.db, MySQLDatabase):
+        sep = "'{}'".format(sep.replace("'", "''"))
+        return fn.GROUP_CONCAT(NodeList((expr, SQL("SEPARATOR " + sep))))
+    elif isinstance(g.db, PostgresqlDatabase):
+        return fn.STRING_AGG(expr, sep)
+    else:
+        return fn.GROUP_CONCAT(expr, sep)
+
+
+def _turf_summary():
+    "Counts and lists of mods per show, from one grouped pass over the turfs."
+
+    def count(state):
+        return fn.SUM(Case(None, [(Turf.state == TURF_LOOKUP[state], 1)], 0))
+
+    def names(state):
+        name = Case(None, [(Turf.state == TURF_LOOKUP[state], Mod.name)])
+        return _string_agg(name, ", ")
+
+    return (
+        Turf.select(
+            Turf.show.alias("showid"),
+            count("lead").alias("leadcount"),
+            count("backup").alias("helpercount"),
+            names("lead").alias("leads"),
+            names("backup").alias("backups"),
+            names("could help").alias("couldhelps"),
+        )
         .join(Mod)
-        .where((Turf.show == Show.id) & (Turf.state == TURF_LOOKUP["could help"]))
-        .alias("couldhelps"),
+        .group_by(Turf.show)
     )
-    .where(~Show.hidden)
-    .where(Show.deleted_at.is_null(True))
-    .order_by(fn.Lower(Show.name).asc())
-)
-# NOTE: group_concat works only in sqlite or mysql
 
 
-def _query_to_csv(query, filename=None):
-    def generate():
-        yield (
-            "name,posts,last_post,gone_forever,has_forum,"
-            "leadcount,helpercount,leads,backups,couldhelps,needs_help\n"
+def turfs_query():
+    summary = _turf_summary().alias("summary")
+    return (
+        Show.select(
+            Show.id,
+            Show.name,
+            Show.forum_posts,
+            Show.forum_topics,
+            Show.last_post,
+            Show.gone_forever,
+            Show.has_forum,
+            fn.COALESCE(summary.c.leadcount, 0).alias("leadcount"),
+            fn.COALESCE(summary.c.helpercount, 0).alias("helpercount"),
+            summary.c.leads.alias("leads"),
+            summary.c.backups.alias("backups"),
+            summary.c.couldhelps.alias("couldhelps"),
+            Show.needs_help,
         )
+        .join(summary, JOIN.LEFT_OUTER, on=(summary.c.showid == Show.id))
+        .where(~Show.hidden)
+        .where(Show.deleted_at.is_null(True))
+        .order_by(fn.Lower(Show.name).asc())
+    )
+
 
-        for r in query:
-            yield ",".join(
-                '"{}"'.format(str(x).replace('"', '\\"'))
-                for x in (
-                    r.name,
-                    r.n_posts(),
-                    "" if r.last_post is None else r.last_post.strftime("%Y-%m-%d"),
-                    int(r.gone_forever),
-                    int(r.has_forum),
-                    r.leadcount,
-                    r.helpercount,
-                    r.leads or "",
-                    r.backups or "",
-                    r.couldhelps or "",
-                    int(r.needs_help),
-                )
-            ) + "\n"
-
-    return Response(
-        generate(),
-        mimetype="text/csv",
-        headers=[
+def _csv_line(values):
+    return ",".join('"{}"'.format(str(x).replace('"', '\\"')) for x in values) + "\n"
+
+
+def _csv_rows(version):
+    "[(show id, csv line)] for every row of the dump, cached for version."
+    key = CSV_ROWS_KEY.format(version)
+    cached = redis.get(key)
+    if cached is not None:
+        return pickle.loads(cached)
+
+    rows = []
+    for r in turfs_query().namedtuples():
+        if r.forum_posts is None or r.forum_topics is None:
+            n_posts = "n/a"
+        else:
+            n_posts = r.forum_posts + r.forum_topics
+        line = _csv_line(
             (
-                "Content-Disposition",
-                f'attachment; filename = "{filename}"' if filename else "attachment",
+                r.name,
+                n_posts,
+                "" if r.last_post is None else r.last_post.strftime("%Y-%m-%d"),
+                int(r.gone_forever),
+                int(r.has_forum),
+                r.leadcount,
+                r.helpercount,
+                r.leads or "",
+                r.backups or "",
+                r.couldhelps or "",
+                int(r.needs_help),
             )
-        ],
+        )
+        rows.append((r.id, line))
+
+    redis.setex(key, app.config.get("TURFS_CSV_TTL", 24 * 60 * 60), pickle.dumps(rows))
+    return rows
+
+
+def _csv_response(etag, make_body, filename=None):
+    """
+    A CSV download with the given ETag, gzipped if the client takes that;
+    make_body() gives the gzipped body, and is only called if needed.
+    """
+    response = Response(mimetype="text/csv")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename = "{filename}"' if filename else "attachment"
     )
+    if etag in request.if_none_match:
+        response.status_code = 304
+        return response
+
+    body = make_body()
+    if request.accept_encodings["gzip"]:
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        body = gzip.decompress(body)
+    response.set_data(body)
+    return response
+
+
+def _gzip_csv(lines):
+    return gzip.compress((CSV_HEADER + "".join(lines)).encode(), compresslevel=6)
+
+
+def _full_csv(version):
+    key = CSV_FULL_KEY.format(version)
+    body = redis.get(key)
+    if body is None:
+        body = _gzip_csv(line for _, line in _csv_rows(version))
+        redis.setex(key, app.config.get("TURFS_CSV_TTL", 24 * 60 * 60), body)
+    return body
+
+
+def _mod_csv(modid, state=None, filename=None):
+    "The dump cut down to modid's shows (with turf state `state`, if given)."
+    version = data_version()
+    etag = "turfs-{}-{}-{}".format(version, modid, state or "all")
+    mine = get_overview().by_mod.get(modid, {})
+
+    def make_body():
+        return _gzip_csv(
+            line
+            for showid, line in _csv_rows(version)
+            if showid in mine and (state is None or mine[showid].state == state)
+        )
+
+    return _csv_response(etag, make_body, filename=filename)
 
 
 @app.route("/turfs.csv")
 @login_required
 def turfs_csv():
-    return _query_to_csv(turfs_query)
+    version = data_version()
+    return _csv_response("turfs-{}".format(version), lambda: _full_csv(version))
 
 
 @app.route("/my-turfs.csv")
 @login_required
 def my_turfs_csv():
-    return _query_to_csv(turfs_query.join(Turf).where(Turf.modid == current_user.id))
+    return _mod_csv(current_user.id)
 
 
 @app.route("/turfs-<int:modid>.csv")
@@ -387,27 +547,16 @@ def turfs_for_csv(modid):
     except Mod.DoesNotExist:
         return abort(404)
     shortname = re.sub("[^a-z0-9]", "", mod.name.lower())
-    return _query_to_csv(
-        turfs_query.join(Turf).where(Turf.modid == modid),
-        filename=f"turfs-{shortname}.csv",
-    )
+    return _mod_csv(modid, filename=f"turfs-{shortname}.csv")
 
 
 @app.route("/my-leads.csv")
 @login_required
 def my_leads_csv():
-    return _query_to_csv(
-        turfs_query.join(Turf).where(
-            (Turf.modid == current_user.id) & (Turf.state == TURF_LOOKUP["lead"])
-        )
-    )
+    return _mod_csv(current_user.id, state=TURF_LOOKUP["lead"])
 
 
 @app.route("/my-backups.csv")
 @login_required
 def my_backups_csv():
-    return _query_to_csv(
-        turfs_query.join(Turf).where(
-            (Turf.modid == current_user.id) & (Turf.state == TURF_LOOKUP["backup"])
-        )
-    )
+    return _mod_csv(current_user.id, state=TURF_LOOKUP["backup"])
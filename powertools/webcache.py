@@ -0,0 +1,277 @@
+from collections import Counter
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from cachecontrol.adapter import CacheControlAdapter
+from cachecontrol.cache import BaseCache
+from cachecontrol.caches import FileCache
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _ttl_for(expires, default_ttl):
+    # newer CacheControls pass a (naive utc) datetime; 0.12 never does
+    if expires is None:
+        return default_ttl
+    return max(1, int((expires - datetime.datetime.utcnow()).total_seconds()))
+
+
+class SQLiteCache(BaseCache):
+    """
+    Keeps a running total of the bytes stored, read from the table once and
+    kept up by set and delete, so only an eviction has to scan the table.
+    Another process writing to the same file isn't counted until then.
+    Evicting goes down to a tenth under max_bytes, so it doesn't happen on
+    every set once the cache is full.
+    """
+    def __init__(self, path, max_bytes=256 * 2**20, ttl=7 * 24 * 60 * 60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "  key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+            "  size INTEGER NOT NULL, expires REAL NOT NULL,"
+            "  accessed REAL NOT NULL)")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.total = self._stored_bytes()
+
+    def _stored_bytes(self):
+        total, = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return total
+
+    def _size(self, key):
+        row = self.conn.execute(
+            "SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires > ?",
+                (key, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, expires=None):
+        now = time.time()
+        expires_at = now + _ttl_for(expires, self.ttl)
+        with self.lock:
+            old = self._size(key)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), expires_at, now))
+            self.total += len(value) - old
+            if self.total > self.max_bytes:
+                self._evict(now)
+
+    def delete(self, key):
+        with self.lock:
+            self.total -= self._size(key)
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        total = self._stored_bytes()
+        target = self.max_bytes * 0.9
+        if total <= target:
+            self.total = total
+            return
+
+        doomed = []
+        cur = self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed ASC")
+        for key, size in cur:
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        self.total = total
+
+    def close(self):
+        self.conn.close()
+
+
+class RedisCache(BaseCache):
+    """
+    Shared across hosts. Values are stored with SETEX; a sorted set of access
+    times plus a hash of sizes lets us evict the LRU entries once the total
+    goes over max_bytes.
+    """
+    def __init__(self, conn, prefix='webcache', max_bytes=256 * 2**20,
+                 ttl=7 * 24 * 60 * 60):
+        self.conn = conn
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lru_key = prefix + ':lru'
+        self.sizes_key = prefix + ':sizes'
+        self.total_key = prefix + ':bytes'
+
+    def _key(self, key):
+        return '{}:v:{}'.format(self.prefix, key)
+
+    def get(self, key):
+        value = self.conn.get(self._key(key))
+        if value is not None:
+            self.conn.zadd(self.lru_key, {key: time.time()})
+        return value
+
+    def set(self, key, value, expires=None):
+        old = self.conn.hget(self.sizes_key, key)
+        pipe = self.conn.pipeline()
+        pipe.setex(self._key(key), _ttl_for(expires, self.ttl), value)
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.hset(self.sizes_key, key, len(value))
+        pipe.incrby(self.total_key, len(value) - int(old or 0))
+        pipe.execute()
+        self._evict()
+
+    def delete(self, key):
+        self._forget(key)
+
+    def _forget(self, key):
+        size = self.conn.hget(self.sizes_key, key)
+        pipe = self.conn.pipeline()
+        pipe.delete(self._key(key))
+        pipe.zrem(self.lru_key, key)
+        pipe.hdel(self.sizes_key, key)
+        if size is not None:
+            pipe.decrby(self.total_key, int(size))
+        pipe.execute()
+
+    def _evict(self):
+        # entries that expired on their own still count until we get here
+        while int(self.conn.get(self.total_key) or 0) > self.max_bytes:
+            oldest = self.conn.zrange(self.lru_key, 0, 99)
+            if not oldest:
+                self.conn.set(self.total_key, 0)
+                break
+            for key in oldest:
+                self._forget(key.decode())
+                if int(self.conn.get(self.total_key) or 0) <= self.max_bytes:
+                    break
+
+
+class CountingCache(BaseCache):
+    """
+    Wraps another cache, counting bytes in and out. CountingAdapter adds
+    hits, revalidations and misses, per response, to the same stats.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, **kwargs):
+        with self.lock:
+            self.stats.update(kwargs)
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.stats)
+
+    def get(self, key):
+        value = self.cache.get(key)
+        if value is not None:
+            self.count(bytes_read=len(value))
+        return value
+
+    def set(self, key, value, expires=None):
+        self.count(sets=1, bytes_written=len(value))
+        if expires is None:
+            self.cache.set(key, value)
+        else:
+            self.cache.set(key, value, expires=expires)
+
+    def delete(self, key):
+        self.count(deletes=1)
+        self.cache.delete(key)
+
+    def close(self):
+        self.cache.close()
+
+
+class _NotingAdapter(HTTPAdapter):
+    # CacheControlAdapter goes through here only when it really sends a request
+    sent = threading.local()
+
+    def send(self, request, **kwargs):
+        self.sent.value = True
+        return super().send(request, **kwargs)
+
+
+class CountingAdapter(CacheControlAdapter, _NotingAdapter):
+    """
+    A CacheControlAdapter that counts each cacheable response into its
+    CountingCache's stats: hits came from the cache without any HTTP,
+    revalidated took a 304 from the server, and misses were downloaded.
+    """
+    def send(self, request, cacheable_methods=None, **kwargs):
+        self.sent.value = False
+        resp = super().send(request, cacheable_methods=cacheable_methods,
+                            **kwargs)
+        if request.method in (cacheable_methods or self.cacheable_methods):
+            if not self.sent.value:
+                self.cache.count(hits=1)
+            elif getattr(resp, 'from_cache', False):
+                self.cache.count(revalidated=1)
+            else:
+                self.cache.count(misses=1)
+        return resp
+
+
+def counting_session(cache):
+    "A requests session going through cache, a CountingCache."
+    sess = requests.session()
+    adapter = CountingAdapter(cache)
+    sess.mount('http://', adapter)
+    sess.mount('https://', adapter)
+    return sess
+
+
+def default_cache_dir():
+    if os.path.exists('/dev/shm/'):
+        return '/dev/shm/{}/web_cache'.format(os.getuid())
+    else:
+        return os.path.expanduser('~/.web_cache')
+
+
+def make_cache(config, redis=None):
+    """
+    Builds the cache described by WEB_CACHE_BACKEND ('file', 'sqlite', or
+    'redis') and friends in config, wrapped in a CountingCache.
+    """
+    backend = config.get('WEB_CACHE_BACKEND', 'file')
+    path = config.get('WEB_CACHE_PATH') or default_cache_dir()
+    max_bytes = config.get('WEB_CACHE_MAX_BYTES', 256 * 2**20)
+    ttl = config.get('WEB_CACHE_TTL', 7 * 24 * 60 * 60)
+
+    if backend == 'file':
+        cache = FileCache(path)
+    elif backend == 'sqlite':
+        if not path.endswith('.sqlite'):
+            path = os.path.join(path, 'cache.sqlite')
+        cache = SQLiteCache(path, max_bytes=max_bytes, ttl=ttl)
+    elif backend == 'redis':
+        cache = RedisCache(redis, max_bytes=max_bytes, ttl=ttl)
+    else:
+        raise ValueError("unknown WEB_CACHE_BACKEND {!r}".format(backend))
+    return CountingCache(cache)
@@ -0,0 +1,22 @@
+from powertools.base import app, db
+from powertools.models import ShowSearchTerm, ShowSearchTrigram
+from powertools.search import sync_search_index
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Bring the show search index up to date, making its "
+                    "tables first if they don't exist yet.")
+    parser.add_argument('ids', nargs='*', type=int,
+                        help="just these shows (default: all of them)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_tables([ShowSearchTerm, ShowSearchTrigram], safe=True)
+        n = sync_search_index(args.ids or None)
+    print("Reindexed {} shows.".format(n))
+
+
+if __name__ == '__main__':
+    main()
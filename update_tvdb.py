@@ -8,14 +8,30 @@ def main(force=False, quiet=False):
     parser.add_argument('--force', '-f', action='store_true', default=False)
     parser.add_argument('--quiet', '-q', dest='verbose', action='store_false',
                         default=True)
+    parser.add_argument('--workers', '-j', type=int, default=None,
+                        help="number of series to fetch at once "
+                             "(default: TVDB_SYNC_WORKERS config, or 1)")
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="split the update into celery tasks of this "
+                             "many series each (default: TVDB_SYNC_CHUNK_SIZE)")
     parser.add_argument('ids', nargs='*', type=int)
     args = parser.parse_args()
 
     with app.app_context():
         if args.ids:
-            update_serieses(args.ids, verbose=args.verbose)
+            update_serieses(args.ids, verbose=args.verbose,
+                            workers=args.workers)
         else:
-            update_db(force=args.force, verbose=args.verbose)
+            res = update_db(force=args.force, verbose=args.verbose,
+                            workers=args.workers, chunk_size=args.chunk_size)
+            if res is not None:
+                summary = res.get()
+                if args.verbose:
+                    for i, chunk in enumerate(summary['chunks']):
+                        print("chunk {}: {n} series in {seconds:.1f}s"
+                              .format(i, **chunk))
+                    print("bad: {bad_ids}\nnot found: {not_found_ids}\n"
+                          "rows: {rows}".format(**summary))
 
 
 if __name__ == '__main__':